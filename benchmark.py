@@ -0,0 +1,425 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import openpyxl
+
+# Benchmark ponta a ponta do "import time.py" sem gastar cota: um servidor local faz o papel
+# da Places API (textsearch, details, findplacefromtext) e dos sites das empresas. O script
+# roda como subprocesso com HTTP_PROXY apontando para esse servidor, então os sites
+# "http://empresaNNNNN.test" e a API em "http://places.test" nunca saem da máquina.
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import time.py")
+ARQ_IN = "Prospecção Novos Clientes.xlsx"
+PLACES_HOST = "places.test"
+PAGE_SIZE = 20
+RESULTS_PER_QUERY = 45  # 3 páginas: 20 + 20 + 5
+
+PREFIXES = ["Embalagens", "Papelão", "Caixas", "Indústria de Papel", "Cartonagem"]
+WORDS = ["Sul", "Norte", "Paulista", "Mineira", "Gaúcha", "Real", "Nova", "União", "Forte", "Brasil"]
+SUFFIXES = ["Ltda", "SA", "ME", "EIRELI", ""]
+COMPANY_ID_RE = re.compile(r"\b(\d{5})\b")
+
+
+def company_name(i: int, variant: int = 0) -> str:
+    rnd = random.Random(i)
+    prefix = rnd.choice(PREFIXES)
+    word = rnd.choice(WORDS)
+    suffix = SUFFIXES[(i + variant) % len(SUFFIXES)]
+    if variant % 2:
+        return f"{word} {i:05d} {prefix} {suffix}".strip()
+    return f"{prefix} {word} {i:05d} {suffix}".strip()
+
+
+def company_site(i: int) -> str:
+    return f"http://empresa{i:05d}.test"
+
+
+def company_phone(i: int) -> str:
+    return f"+55 11 3{i % 1000:03d}-{i % 10000:04d}"
+
+
+def company_address(i: int) -> str:
+    return f"Rua das Indústrias, {100 + i % 900} - São Paulo, SP"
+
+
+def make_workbook(path, rows=2000, curva_rows=20000, base_rows=5000, dup_ratio=0.1, crm_ratio=0.05, seed=1):
+    """Gera uma "Prospecção Novos Clientes.xlsx" sintética com as quatro abas do script."""
+    rnd = random.Random(seed)
+    wb = openpyxl.Workbook()
+
+    ws = wb.active
+    ws.title = "Clientes"
+    ws.append(["Tipo da fábrica", "Nome", "Site", "Telefone", "Endereço"])
+    companies = []
+    for r in range(rows):
+        if companies and rnd.random() < dup_ratio:
+            i = rnd.choice(companies)
+            variant = rnd.randint(1, 3)
+        else:
+            i = len(companies) + 1
+            companies.append(i)
+            variant = 0
+        site = company_site(i) if rnd.random() < 0.8 else None
+        prefilled = rnd.random() < 0.1
+        ws.append([
+            "Papelão ondulado",
+            company_name(i, variant),
+            site,
+            company_phone(i) if prefilled else None,
+            company_address(i) if prefilled else None,
+        ])
+
+    removed = wb.create_sheet("Removidos")
+    removed.append(["Tipo da fábrica", "Nome", "Site", "Telefone", "Endereço", "Motivo"])
+
+    # Clientes já existentes no CRM: parte da BASE usa nomes de empresas da aba Clientes.
+    base_ids = [rnd.choice(companies) for _ in range(int(len(companies) * crm_ratio))]
+    base_ids += list(range(100000, 100000 + max(0, base_rows - len(base_ids))))
+    base = wb.create_sheet("BASE REPRESENTANTES")
+    base.append(["Cliente Razão Social", "Nome Fantasia", "Cidade", "Ultima Compra"])
+    for i in base_ids:
+        base.append([company_name(i), company_name(i, 1) if rnd.random() < 0.5 else None, "São Paulo", None])
+
+    years = list(range(2019, 2025))
+    curva = wb.create_sheet("CURVA ABC")
+    curva.append(["Cliente", "Classe"] + years)
+    for _ in range(curva_rows):
+        i = rnd.choice(base_ids)
+        amounts = [
+            rnd.choice([None, 0, round(rnd.uniform(100, 90000), 2), f"{rnd.randint(1, 90000)},{rnd.randint(0, 99):02d}"])
+            for _ in years
+        ]
+        curva.append([company_name(i), rnd.choice("ABC")] + amounts)
+
+    wb.save(path)
+    return len(companies)
+
+
+class StandIn:
+    """Estado do servidor local: configuração, contadores e linha do tempo por empresa."""
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.statuses = {}
+        self.company_times = {}  # empresa -> [primeira, última] requisição
+
+    def count(self, kind, status, company=None):
+        now = time.monotonic()
+        with self.lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            if company is not None:
+                span = self.company_times.setdefault(company, [now, now])
+                span[1] = now
+
+    def delay(self):
+        with self.lock:
+            extra = self.rnd.uniform(-self.jitter, self.jitter)
+            fail = self.rnd.random() < self.error_rate
+        time.sleep(max(0.0, self.latency + extra))
+        return fail
+
+
+def places_results(company: int, page: int):
+    start = page * PAGE_SIZE
+    true_pos = (company * 7) % 30
+    results = []
+    for k in range(start, min(start + PAGE_SIZE, RESULTS_PER_QUERY)):
+        if k == true_pos:
+            results.append({
+                "place_id": f"c{company:05d}-0",
+                "name": company_name(company),
+                "formatted_address": company_address(company),
+                "business_status": "OPERATIONAL",
+            })
+        else:
+            results.append({
+                "place_id": f"c{company:05d}-{k + 1}",
+                "name": f"Distribuidora {WORDS[k % len(WORDS)]} {k}",
+                "formatted_address": f"Avenida Central, {k} - Campinas, SP",
+                "business_status": "OPERATIONAL" if k % 3 else "CLOSED_TEMPORARILY",
+            })
+    return results
+
+
+def place_details(place_id: str):
+    company, k = place_id[1:].split("-")
+    company, k = int(company), int(k)
+    if k == 0:
+        det = {
+            "name": company_name(company),
+            "website": company_site(company) + "/",
+            "formatted_address": company_address(company),
+            "business_status": "OPERATIONAL",
+        }
+        # Um terço das empresas não tem telefone no Places e depende do site.
+        if company % 3:
+            det["formatted_phone_number"] = company_phone(company)
+        return det
+    return {
+        "name": f"Distribuidora {WORDS[k % len(WORDS)]} {k}",
+        "website": f"http://distribuidora{k}.test/",
+        "formatted_address": f"Avenida Central, {k} - Campinas, SP",
+        "business_status": "OPERATIONAL",
+    }
+
+
+def site_page(company: int, path: str):
+    """(status, html) de um site sintético; None simula host fora do ar."""
+    kind = company % 10
+    if kind == 0:
+        return None
+    path = path.rstrip("/") or "/"
+    if path == "/":
+        jsonld = ""
+        if kind in (1, 2):
+            jsonld = (
+                '<script type="application/ld+json">'
+                + json.dumps({
+                    "@type": "Organization",
+                    "telephone": company_phone(company),
+                    "address": {"streetAddress": company_address(company), "addressCountry": "BR"},
+                }, ensure_ascii=False)
+                + "</script>"
+            )
+        body = "<p>" + " ".join(["Fabricamos embalagens de papelão ondulado sob medida."] * 40) + "</p>"
+        return 200, f'<html><head>{jsonld}</head><body><a href="/contato">Fale conosco</a>{body}</body></html>'
+    if path == "/contato" and 3 <= kind <= 6:
+        return 200, (
+            f"<html><body><h1>Contato</h1><p>Telefone: {company_phone(company)}</p>"
+            f"<p>{company_address(company)}</p></body></html>"
+        )
+    return 404, "<html><body>Página não encontrada</body></html>"
+
+
+def make_handler(state: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, status, body, content_type):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            # Via proxy a linha de requisição traz a URL absoluta; o host diz quem responde.
+            url = urlparse(self.path)
+            host = (url.netloc or self.headers.get("Host", "")).split(":")[0].lower()
+            fail = state.delay()
+            if host == PLACES_HOST:
+                self.places(url, fail)
+            else:
+                self.site(host, url.path, fail)
+
+        def places(self, url, fail):
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            endpoint = url.path.rsplit("/", 2)[-2]
+            company = None
+            if endpoint == "textsearch":
+                if "pagetoken" in params:
+                    query, page = urlsafe_b64decode(params["pagetoken"]).decode("utf-8").rsplit("|", 1)
+                    page = int(page)
+                else:
+                    query, page = params.get("query", ""), 0
+                m = COMPANY_ID_RE.search(query)
+                company = int(m.group(1)) if m else None
+                data = {"status": "ZERO_RESULTS", "results": []}
+                if company is not None:
+                    data = {"status": "OK", "results": places_results(company, page)}
+                    if (page + 1) * PAGE_SIZE < RESULTS_PER_QUERY:
+                        data["next_page_token"] = urlsafe_b64encode(f"{query}|{page + 1}".encode("utf-8")).decode("ascii")
+            elif endpoint == "details":
+                place_id = params.get("place_id", "")
+                company = int(place_id[1:6]) if place_id[1:6].isdigit() else None
+                data = {"status": "OK", "result": place_details(place_id)} if company is not None else {"status": "INVALID_REQUEST"}
+            elif endpoint == "findplacefromtext":
+                m = COMPANY_ID_RE.search(params.get("input", ""))
+                company = int(m.group(1)) if m else None
+                candidates = []
+                if company is not None:
+                    candidates = [dict(place_details(f"c{company:05d}-0"), place_id=f"c{company:05d}-0")]
+                data = {"status": "OK" if candidates else "ZERO_RESULTS", "candidates": candidates}
+            else:
+                state.count("places_other", 404)
+                return self.send(404, "{}", "application/json")
+
+            status = 500 if fail else 200
+            state.count(endpoint, status, company)
+            if fail:
+                return self.send(500, '{"status": "UNKNOWN_ERROR"}', "application/json")
+            self.send(200, json.dumps(data, ensure_ascii=False), "application/json; charset=UTF-8")
+
+        def site(self, host, path, fail):
+            m = re.match(r"empresa(\d{5})\.test$", host)
+            company = int(m.group(1)) if m else None
+            page = site_page(company, path) if company is not None else (404, "")
+            if page is None:
+                # Host "fora do ar": derruba a conexão sem responder.
+                state.count("site", "dead", company)
+                self.close_connection = True
+                return
+            status, html = (500, "") if fail else page
+            state.count("site", status, company)
+            self.send(status, html, "text/html; charset=utf-8")
+
+    return Handler
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Conexões derrubadas pelo cliente (cancelamentos, hosts "fora do ar") são esperadas.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_script(workdir, port, extra_env, script_args=()):
+    """Roda o script no diretório de trabalho e devolve (segundos, código de saída, pico de RSS em MB)."""
+    env = dict(os.environ)
+    env.update({
+        "GOOGLE_MAPS_API_KEY": "benchmark",
+        "PLACES_API_BASE": f"http://{PLACES_HOST}/maps/api/place",
+        "HTTP_PROXY": f"http://127.0.0.1:{port}",
+        "http_proxy": f"http://127.0.0.1:{port}",
+        "NO_PROXY": "",
+        "no_proxy": "",
+    })
+    env.update(extra_env)
+    # A saída vai para um arquivo, não para um pipe: o wait4 abaixo só volta no fim do
+    # script, e um pipe cheio (PROGRESS=1, traceback longo) travaria os dois processos.
+    with tempfile.TemporaryFile() as out:
+        started = time.monotonic()
+        proc = subprocess.Popen([sys.executable, SCRIPT, *script_args], cwd=workdir, env=env, stdout=out, stderr=subprocess.STDOUT)
+        peak_rss_mb = None
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss vem em KB no Linux e em bytes no macOS.
+            peak_rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        else:
+            proc.wait()
+        out.seek(0)
+        output = out.read().decode("utf-8", errors="replace")
+    return time.monotonic() - started, proc.returncode, peak_rss_mb, output
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark do enriquecimento contra uma Places API e sites locais.")
+    ap.add_argument("--rows", type=int, default=200, help="linhas na aba Clientes")
+    ap.add_argument("--curva-rows", type=int, default=5000, help="linhas na aba CURVA ABC")
+    ap.add_argument("--base-rows", type=int, default=2000, help="linhas na aba BASE REPRESENTANTES")
+    ap.add_argument("--dup-ratio", type=float, default=0.1, help="fração de linhas repetindo uma empresa")
+    ap.add_argument("--latency", type=float, default=0.05, help="latência simulada por requisição (s)")
+    ap.add_argument("--jitter", type=float, default=0.02, help="variação da latência (s)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fração de respostas HTTP 500")
+    ap.add_argument("--runs", type=int, default=2, help="execuções seguidas no mesmo diretório (a 2ª mede os caches)")
+    ap.add_argument("--env", action="append", default=[], help="variável extra para o script, ex.: WORKERS=16")
+    ap.add_argument("--arg", action="append", default=[], help="argumento extra para o script, ex.: --arg=enrich-places")
+    ap.add_argument("--report", help="grava o relatório em JSON neste caminho")
+    ap.add_argument("--keep", action="store_true", help="mantém o diretório temporário com planilhas e caches")
+    args = ap.parse_args(argv)
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    extra_env.setdefault("PLACES_TEXTSEARCH_QPS", "0")
+    extra_env.setdefault("PLACES_DETAILS_QPS", "0")
+    extra_env.setdefault("PLACES_FINDPLACE_QPS", "0")
+    extra_env.setdefault("SITE_QPS", "0")
+
+    workdir = tempfile.mkdtemp(prefix="bench_crm_")
+    # A planilha é gerada num processo à parte: o pico de RSS medido do script (ru_maxrss do
+    # filho) herda o tamanho deste processo no fork, e a planilha grande inflaria a medida.
+    with multiprocessing.get_context("spawn").Pool(1) as gen:
+        companies = gen.apply(
+            make_workbook,
+            (os.path.join(workdir, ARQ_IN),),
+            {"rows": args.rows, "curva_rows": args.curva_rows, "base_rows": args.base_rows, "dup_ratio": args.dup_ratio},
+        )
+
+    report = {"workdir": workdir, "rows": args.rows, "companies": companies, "config": vars(args), "runs": []}
+    for run in range(args.runs):
+        state = StandIn(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=run)
+        server = QuietServer(("127.0.0.1", 0), make_handler(state))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            seconds, code, peak_rss_mb, output = run_script(workdir, server.server_address[1], extra_env, args.arg)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Intervalo entre a primeira e a última requisição de cada empresa vista pelo servidor
+        # (não é a latência por linha: não inclui fila, planilha nem cache local).
+        spans = [last - first for first, last in state.company_times.values()]
+        api_calls = sum(state.calls.get(k, 0) for k in ("textsearch", "details", "findplacefromtext"))
+        result = {
+            "run": run + 1,
+            "exit_code": code,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(args.rows / seconds, 2) if seconds else None,
+            "company_request_span_p50": percentile(spans, 50),
+            "company_request_span_p95": percentile(spans, 95),
+            "api_calls": dict(state.calls),
+            "api_calls_per_row": round(api_calls / args.rows, 2) if args.rows else None,
+            "site_requests_per_row": round(state.calls.get("site", 0) / args.rows, 2) if args.rows else None,
+            "http_status": dict(state.statuses),
+            "peak_rss_mb": round(peak_rss_mb, 1) if peak_rss_mb is not None else None,
+        }
+        report["runs"].append(result)
+        if code != 0:
+            print(output)
+
+        p50 = result["company_request_span_p50"]
+        p95 = result["company_request_span_p95"]
+        print(f"Execução {run + 1}: {result['seconds']}s, {result['rows_per_sec']} linhas/s, saída {code}")
+        if p50 is not None:
+            print(f"  1ª→última requisição por empresa (servidor) p50/p95: {p50:.3f}s / {p95:.3f}s")
+        print(f"  chamadas Places por linha: {result['api_calls_per_row']}  requisições a sites por linha: {result['site_requests_per_row']}")
+        print(f"  pico de RSS: {result['peak_rss_mb']} MB")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print("Relatório:", args.report)
+    if args.keep:
+        print("Arquivos:", workdir)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,122 @@
-﻿import os
+﻿import io
+import os
 import re
 import time
 import json
+import sys
+import argparse
+import csv
+import hashlib
 import shutil
+import random
+import sqlite3
 import tempfile
+import threading
+import codecs
 import subprocess
 import unicodedata
-from urllib.parse import urlparse, urljoin
+import zlib
+import multiprocessing
+from array import array
+from contextlib import contextmanager
+from html import unescape
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from urllib.parse import unquote, urlparse, urljoin
 
 import openpyxl
-import requests
-from bs4 import BeautifulSoup, FeatureNotFound
+from openpyxl.utils import get_column_letter
+
+try:
+    import numpy as np
+except ImportError:  # opcional: sem NumPy a CURVA ABC é calculada em Python puro
+    np = None
 
 API_KEY = os.getenv("GOOGLE_MAPS_API_KEY", "SUA_KEY_AQUI")
-ARQ_IN = r"Prospecção Novos Clientes.xlsx"
-ARQ_OUT = r"Prospecção Novos Clientes - preenchido.xlsx"
+PLACES_API_BASE = os.getenv("PLACES_API_BASE", "https://maps.googleapis.com/maps/api/place").rstrip("/")
+ARQ_IN = r"Prospecção Novos Clientes.xlsx"  # padrão de --input
+ARQ_OUT = r"Prospecção Novos Clientes - preenchido.xlsx"  # padrão de --output
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH")  # None = "<saída>.checkpoint.jsonl"; "" desativa
+
+# Etapas do CLI, na ordem em que rodam; sem nenhuma na linha de comando, rodam todas.
+STAGES = ("last-purchase", "dedupe-crm", "dedupe-clientes", "enrich-places", "enrich-site")
+
+# Quase duplicados dentro da aba Clientes (etapa dedupe-clientes): Jaccard mínimo entre os
+# tokens_name; os candidatos saem de MinHash/LSH (bandas x linhas por banda da assinatura).
+CLIENTES_DUP_THRESHOLD = float(os.getenv("CLIENTES_DUP_THRESHOLD", "0.8"))
+MINHASH_BANDS = 9
+MINHASH_ROWS = 4
+
+# Histórico por linha (impressão digital das entradas -> resultado) para reexecuções incrementais.
+HISTORY_PATH = os.getenv("HISTORY_PATH", "enrich_history.sqlite3")  # "" desativa
+HISTORY_OK_TTL = float(os.getenv("HISTORY_OK_TTL", str(30 * 86400)))  # validade de um resultado OK
+HISTORY_RETRY_AFTER = float(os.getenv("HISTORY_RETRY_AFTER", str(7 * 86400)))  # nova tentativa de PARCIAL/NAO_ENCONTRADO
+
+RUN_REPORT_PATH = os.getenv("RUN_REPORT_PATH")  # relatório JSON; None = "<saída>.report.json"; "" desativa
+PROGRESS = os.getenv("PROGRESS", "0") == "1"  # linha de progresso (linhas/s e ETA) no stderr
 
 SHEET = "Clientes"
 HEADER_ROW = 1
 TOP_N = 12
-SLEEP = 0.25
-MAX_ROWS = int(os.getenv("MAX_ROWS", "0"))  # 0 = processa tudo
+ACCEPT_SCORE = 6.0  # score a partir do qual o candidato é aceito sem buscar mais
+DETAILS_TOP_K = int(os.getenv("DETAILS_TOP_K", "5"))  # details por consulta, após o pré-ranking
+MAX_ROWS = int(os.getenv("MAX_ROWS", "0"))  # padrão de --max-rows; 0 = processa tudo
+WORKERS = max(1, int(os.getenv("WORKERS", "8")))  # linhas enriquecidas em paralelo (por processo)
+PROCESSES = int(os.getenv("PROCESSES", "1"))  # padrão de --processes; 0 = um por núcleo
+SITE_HOST_CONCURRENCY = max(1, int(os.getenv("SITE_HOST_CONCURRENCY", "4")))  # páginas simultâneas por site
+
+# Limites de taxa (requisições/s) por tipo de chamada; 0 = sem limite.
+RATE_LIMITS = {
+    "textsearch": float(os.getenv("PLACES_TEXTSEARCH_QPS", "5")),
+    "details": float(os.getenv("PLACES_DETAILS_QPS", "10")),
+    "findplace": float(os.getenv("PLACES_FINDPLACE_QPS", "5")),
+    "site": float(os.getenv("SITE_QPS", "8")),
+}
+
+# Cache persistente das chamadas ao Google Places ("" desativa).
+PLACES_CACHE_PATH = os.getenv("PLACES_CACHE_PATH", "places_cache.sqlite3")
+PLACES_CACHE_OFFLINE = os.getenv("PLACES_CACHE_OFFLINE", "0") == "1"  # 1 = nunca chama a API, só usa o cache
+PLACES_CACHE_TTL = {  # segundos
+    "textsearch": float(os.getenv("PLACES_CACHE_TTL_TEXTSEARCH", str(7 * 86400))),
+    "details": float(os.getenv("PLACES_CACHE_TTL_DETAILS", str(30 * 86400))),
+    "findplace": float(os.getenv("PLACES_CACHE_TTL_FINDPLACE", str(30 * 86400))),
+}
+PLACES_CACHE_MAX_ENTRIES = {  # 0 = sem limite
+    "textsearch": int(os.getenv("PLACES_CACHE_MAX_TEXTSEARCH", "50000")),
+    "details": int(os.getenv("PLACES_CACHE_MAX_DETAILS", "200000")),
+    "findplace": int(os.getenv("PLACES_CACHE_MAX_FINDPLACE", "50000")),
+}
+PLACES_CACHEABLE_STATUS = {"OK", "ZERO_RESULTS"}
+
+# Cache persistente do scraper de sites ("" desativa).
+SITE_CACHE_PATH = os.getenv("SITE_CACHE_PATH", "site_cache.sqlite3")
+SITE_DEAD_HOST_TTL = float(os.getenv("SITE_DEAD_HOST_TTL", str(86400)))  # host sem resposta/DNS
+SITE_MISSING_URL_TTL = float(os.getenv("SITE_MISSING_URL_TTL", str(30 * 86400)))  # página 404/410
+SITE_MAX_BYTES = int(os.getenv("SITE_MAX_BYTES", str(2 * 1024 * 1024)))  # corpo máximo lido por página
+SITE_FETCH_DEADLINE = float(os.getenv("SITE_FETCH_DEADLINE", "25"))  # segundos por página, download incluso
+SITE_SNIFF_BYTES = 16 * 1024  # prefixo usado na detecção de charset
+SITE_PAGE_CACHE_MAX_BYTES = int(os.getenv("SITE_PAGE_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))  # 0 = sem cache de páginas
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+# Base local de empresas já resolvidas (nome normalizado / domínio / place_id -> contato),
+# compartilhada entre planilhas e consultada antes de qualquer chamada de rede ("" desativa).
+COMPANY_STORE_PATH = os.getenv("COMPANY_STORE_PATH", "company_store.sqlite3")
+COMPANY_STORE_TTL = float(os.getenv("COMPANY_STORE_TTL", str(90 * 86400)))  # validade de um contato
+
+# Modelos de consulta do Text Search na ordem padrão ({alt} = nome sem sufixos, canonical_name).
+# Com ADAPTIVE_QUERIES=1 a ordem segue a taxa de acerto de cada modelo nas execuções anteriores
+# (guardada na base local de empresas); modelos que nunca acertaram em QUERY_PRUNE_MIN_TRIES
+# tentativas só rodam no fim, se nenhum outro achou a empresa.
+QUERY_TEMPLATES = (
+    "{nome} {domain} Brasil",
+    "{alt} {domain} Brasil",
+    "{nome} embalagens Brasil",
+    "{alt} embalagens Brasil",
+    "{nome} papelão ondulado Brasil",
+    "{alt} Brasil",
+    "{nome} Brasil",
+)
+ADAPTIVE_QUERIES = os.getenv("ADAPTIVE_QUERIES", "1") == "1"
+QUERY_PRUNE_MIN_TRIES = int(os.getenv("QUERY_PRUNE_MIN_TRIES", "50"))
 
 PHONE_RE = re.compile(
     r"(?:(?:\+?55)\s*)?"
@@ -34,20 +130,245 @@ ADDR_HINT_RE = re.compile(
     re.IGNORECASE,
 )
 
+# Extração rápida direto do HTML cru, sem montar a árvore do BeautifulSoup.
+JSONLD_BLOCK_RE = re.compile(
+    r"<script\b[^>]*?\btype\s*=\s*([\"']?)application/ld\+json\1[^>]*>(.*?)</script\s*>",
+    re.IGNORECASE | re.DOTALL,
+)
+NON_TEXT_RE = re.compile(r"<(script|style|template)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+TAG_RE = re.compile(r"<[^>]*>")
+CHARSET_RE = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+META_CHARSET_RE = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+
 COMPANY_SUFFIX_RE = re.compile(
     r"\b(SA|S\.?A\.?|LTDA|EIRELI|ME|EPP|INDUSTRIA|INDUSTRIAL|COMERCIO|COMERCIAL|EMBALAGENS?)\b",
     re.IGNORECASE,
 )
 
-SESSION = requests.Session()
-SESSION.headers.update(
-    {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120 Safari/537.36"
-    }
-)
+# requests e BeautifulSoup só são importados por load_http_stack(), quando alguma etapa de
+# enriquecimento vai rodar; as etapas só de planilha não pagam por eles.
+requests = None
+chardet = None
+BeautifulSoup = FeatureNotFound = SoupStrainer = None
+SESSION = None
+
+
+def load_http_stack():
+    global requests, chardet, BeautifulSoup, FeatureNotFound, SoupStrainer, SESSION
+    if SESSION is not None:
+        return
+    import requests
+    from requests.compat import chardet
+    from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
+
+    session = requests.Session()
+    session.headers.update(
+        {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120 Safari/537.36"
+        }
+    )
+    # Conexões keep-alive reaproveitadas por host (Google + os sites em andamento).
+    pool_maxsize = max(WORKERS * 2, SITE_HOST_CONCURRENCY)
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=WORKERS * 4, pool_maxsize=pool_maxsize))
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=WORKERS * 4, pool_maxsize=pool_maxsize))
+    SESSION = session
+
+
+class RunMetrics:
+    """Tempos por etapa, contadores e estatísticas por tipo de chamada externa,
+    compartilhados entre threads, para o relatório JSON da execução."""
+
+    LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.timers = {}
+        self.calls = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + time.monotonic() - started
+
+    def incr(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name: str, seconds: float):
+        with self.lock:
+            self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    def record_call(self, kind: str, seconds: float, status, nbytes: int = 0):
+        bucket = 0
+        while bucket < len(self.LATENCY_BUCKETS_MS) and seconds * 1000 > self.LATENCY_BUCKETS_MS[bucket]:
+            bucket += 1
+        with self.lock:
+            call = self.calls.get(kind)
+            if call is None:
+                call = self.calls[kind] = {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "bytes": 0,
+                    "status": {},
+                    "latency_ms_histogram": [0] * (len(self.LATENCY_BUCKETS_MS) + 1),
+                }
+            call["count"] += 1
+            call["seconds"] += seconds
+            call["max_seconds"] = max(call["max_seconds"], seconds)
+            call["bytes"] += nbytes
+            call["status"][str(status)] = call["status"].get(str(status), 0) + 1
+            call["latency_ms_histogram"][bucket] += 1
+
+    def drain(self) -> dict:
+        """Devolve e zera contadores, tempos e chamadas (o que um processo filho manda ao pai)."""
+        with self.lock:
+            data = {"counters": self.counters, "timers": self.timers, "calls": self.calls}
+            self.counters, self.timers, self.calls = {}, {}, {}
+        return data
+
+    def merge(self, data: dict):
+        """Soma o resultado de drain() de outro processo."""
+        with self.lock:
+            for name, n in data["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, seconds in data["timers"].items():
+                self.timers[name] = self.timers.get(name, 0.0) + seconds
+            for kind, other in data["calls"].items():
+                call = self.calls.get(kind)
+                if call is None:
+                    self.calls[kind] = other
+                    continue
+                call["count"] += other["count"]
+                call["seconds"] += other["seconds"]
+                call["max_seconds"] = max(call["max_seconds"], other["max_seconds"])
+                call["bytes"] += other["bytes"]
+                for status, n in other["status"].items():
+                    call["status"][status] = call["status"].get(status, 0) + n
+                call["latency_ms_histogram"] = [a + b for a, b in zip(call["latency_ms_histogram"], other["latency_ms_histogram"])]
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+                "elapsed_seconds": round(time.time() - self.started_at, 3),
+                "stages_seconds": {k: round(v, 3) for k, v in self.stages.items()},
+                "counters": dict(self.counters),
+                "timers_seconds": {k: round(v, 3) for k, v in self.timers.items()},
+                "latency_buckets_ms": list(self.LATENCY_BUCKETS_MS) + ["inf"],
+                "calls": {k: dict(v, seconds=round(v["seconds"], 3), max_seconds=round(v["max_seconds"], 3)) for k, v in self.calls.items()},
+            }
+
+    def write(self, path: str, extra: dict = None):
+        if not path:
+            return
+        report = self.as_dict()
+        report.update(extra or {})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+METRICS = RunMetrics()
+
+
+class ProgressLine:
+    """Linha de progresso no stderr (linhas/s e ETA), redesenhada no máximo a cada meio segundo."""
+
+    def __init__(self, total: int, enabled: bool = True):
+        self.total = total
+        self.enabled = enabled and total > 0
+        self.started = time.monotonic()
+        self.last_draw = 0.0
+
+    def update(self, done: int):
+        now = time.monotonic()
+        if not self.enabled or (now - self.last_draw < 0.5 and done < self.total):
+            return
+        self.last_draw = now
+        rate = done / (now - self.started) if now > self.started else 0.0
+        eta = (self.total - done) / rate if rate > 0 else 0.0
+        sys.stderr.write(f"\r{done}/{self.total} linhas  {rate:.2f} linhas/s  ETA {int(eta // 60)}m{int(eta % 60):02d}s ")
+        sys.stderr.flush()
+
+    def finish(self):
+        if self.enabled:
+            sys.stderr.write("\n")
+
+
+def timed_get(kind: str, url: str, **kwargs):
+    """SESSION.get com tempo, status e bytes registrados em METRICS (exceto corpo em streaming)."""
+    started = time.monotonic()
+    try:
+        r = SESSION.get(url, **kwargs)
+    except requests.RequestException as e:
+        METRICS.record_call(kind, time.monotonic() - started, type(e).__name__)
+        raise
+    nbytes = 0 if kwargs.get("stream") else len(r.content)
+    METRICS.record_call(kind, time.monotonic() - started, r.status_code, nbytes)
+    return r
+
+
+class TokenBucket:
+    """Limitador de taxa compartilhado entre threads: `rate` fichas/s, rajada de até `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+RATE_LIMITERS = {name: TokenBucket(rate) for name, rate in RATE_LIMITS.items()}
+
+
+def rate_limit(kind: str):
+    started = time.monotonic()
+    RATE_LIMITERS[kind].acquire()
+    METRICS.add_time(f"rate_limit_wait_{kind}", time.monotonic() - started)
+
+
+_HOST_SLOTS = {}
+_HOST_SLOTS_LOCK = threading.Lock()
+
+
+def host_slot(url: str):
+    """Semáforo que limita as requisições simultâneas a um mesmo host."""
+    host = urlparse(url).netloc.lower()
+    with _HOST_SLOTS_LOCK:
+        slot = _HOST_SLOTS.get(host)
+        if slot is None:
+            slot = _HOST_SLOTS[host] = threading.BoundedSemaphore(SITE_HOST_CONCURRENCY)
+    return slot
+
+
+SITE_POOL = ThreadPoolExecutor(max_workers=WORKERS * SITE_HOST_CONCURRENCY, thread_name_prefix="site")
 
 
 def has_api_key() -> bool:
+    if PLACES_CACHE_OFFLINE:
+        return True
     return bool(API_KEY and API_KEY != "SUA_KEY_AQUI")
 
 
@@ -91,52 +412,252 @@ def get_domain(site: str) -> str:
         return ""
 
 
-def places_text_search_page(query: str, pagetoken: str = None):
-    url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+# Hosts onde cada empresa é só uma página (rede social, construtor de sites, link
+# de WhatsApp): o domínio não identifica a empresa, só a URL completa.
+SHARED_SITE_HOSTS = (
+    "facebook.com", "fb.com", "instagram.com", "linkedin.com", "twitter.com", "x.com",
+    "youtube.com", "tiktok.com", "google.com", "goo.gl", "wa.me", "whatsapp.com",
+    "linktr.ee", "wixsite.com", "wix.com", "blogspot.com", "wordpress.com",
+    "negocio.site", "business.site", "webnode.com", "webnode.page", "weebly.com",
+    "ueniweb.com", "mercadolivre.com.br", "olx.com.br",
+)
+
+
+def is_shared_host(domain: str) -> bool:
+    return any(domain == h or domain.endswith("." + h) for h in SHARED_SITE_HOSTS)
+
+
+def company_domain(site: str) -> str:
+    """Domínio próprio da empresa; vazio quando o site está num host compartilhado."""
+    domain = get_domain(site)
+    return "" if is_shared_host(domain) else domain
+
+
+def site_key(site: str) -> str:
+    """Chave que identifica a empresa pelo site: o domínio próprio ou, em host
+    compartilhado, a URL completa normalizada (sem esquema, www e barra final)."""
+    domain = get_domain(site)
+    if not domain or not is_shared_host(domain):
+        return domain
+    path = urlparse(normalize_url(site)).path.rstrip("/").lower()
+    return domain + path
+
+
+_PLACES_CACHE_DB = None
+_PLACES_CACHE_LOCK = threading.RLock()
+
+
+def places_cache_db():
+    global _PLACES_CACHE_DB
+    with _PLACES_CACHE_LOCK:
+        if _PLACES_CACHE_DB is None and PLACES_CACHE_PATH:
+            # timeout alto: com --processes, vários processos gravam no mesmo arquivo.
+            db = sqlite3.connect(PLACES_CACHE_PATH, check_same_thread=False, timeout=60)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS places_cache ("
+                "endpoint TEXT NOT NULL, key TEXT NOT NULL, payload TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+                "PRIMARY KEY (endpoint, key))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS ix_places_cache_lru ON places_cache (endpoint, accessed_at)")
+            now = time.time()
+            for endpoint, ttl in PLACES_CACHE_TTL.items():
+                db.execute("DELETE FROM places_cache WHERE endpoint = ? AND created_at < ?", (endpoint, now - ttl))
+            db.commit()
+            _PLACES_CACHE_DB = db
+        return _PLACES_CACHE_DB
+
+
+def places_cache_get(endpoint: str, key: str):
+    with _PLACES_CACHE_LOCK:
+        db = places_cache_db()
+        if db is None:
+            return None
+        row = db.execute(
+            "SELECT payload, created_at FROM places_cache WHERE endpoint = ? AND key = ?",
+            (endpoint, key),
+        ).fetchone()
+        if not row:
+            return None
+        now = time.time()
+        if now - row[1] > PLACES_CACHE_TTL.get(endpoint, 0):
+            db.execute("DELETE FROM places_cache WHERE endpoint = ? AND key = ?", (endpoint, key))
+            db.commit()
+            return None
+        db.execute("UPDATE places_cache SET accessed_at = ? WHERE endpoint = ? AND key = ?", (now, endpoint, key))
+        db.commit()
+        return json.loads(row[0])
+
+
+def places_cache_has(endpoint: str, key: str) -> bool:
+    with _PLACES_CACHE_LOCK:
+        db = places_cache_db()
+        if db is None:
+            return False
+        row = db.execute(
+            "SELECT 1 FROM places_cache WHERE endpoint = ? AND key = ? AND created_at >= ?",
+            (endpoint, key, time.time() - PLACES_CACHE_TTL.get(endpoint, 0)),
+        ).fetchone()
+        return row is not None
+
+
+def places_cache_put(endpoint: str, key: str, data: dict):
+    with _PLACES_CACHE_LOCK:
+        db = places_cache_db()
+        if db is None or data.get("status") not in PLACES_CACHEABLE_STATUS:
+            return
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO places_cache (endpoint, key, payload, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (endpoint, key, json.dumps(data, ensure_ascii=False), now, now),
+        )
+        max_entries = PLACES_CACHE_MAX_ENTRIES.get(endpoint, 0)
+        if max_entries > 0:
+            # Descarta as entradas menos usadas recentemente acima do limite.
+            db.execute(
+                "DELETE FROM places_cache WHERE endpoint = ? AND key IN ("
+                "SELECT key FROM places_cache WHERE endpoint = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (endpoint, endpoint, max_entries),
+            )
+        db.commit()
+
+
+def close_places_cache():
+    global _PLACES_CACHE_DB
+    with _PLACES_CACHE_LOCK:
+        if _PLACES_CACHE_DB is not None:
+            _PLACES_CACHE_DB.close()
+            _PLACES_CACHE_DB = None
+
+
+def places_cache_key(*parts) -> str:
+    return json.dumps([p or "" for p in parts], ensure_ascii=False)
+
+
+def places_text_search_page(query: str, page_idx: int = 0, pagetoken: str = None, refresh: bool = False):
+    """Página `page_idx` (0 = primeira) do text search, em cache por (consulta, página).
+    Devolve (dados, ao_vivo); só um next_page_token vindo de chamada ao vivo ainda vale.
+    Com `refresh`, o cache não é lido (mas é atualizado)."""
+    key = places_cache_key(query, page_idx)
+    cached = None if refresh and not PLACES_CACHE_OFFLINE else places_cache_get("textsearch", key)
+    if cached is not None:
+        METRICS.incr("places_cache_hit_textsearch")
+        return cached, False
+    METRICS.incr("places_cache_miss_textsearch")
+    if PLACES_CACHE_OFFLINE:
+        return {"status": "CACHE_MISS", "results": []}, False
+
+    url = f"{PLACES_API_BASE}/textsearch/json"
     params = {"query": query, "key": API_KEY}
     if pagetoken:
         params = {"pagetoken": pagetoken, "key": API_KEY}
-    r = SESSION.get(url, params=params, timeout=30)
+    rate_limit("textsearch")
+    r = timed_get("textsearch", url, params=params, timeout=30)
     r.raise_for_status()
-    return r.json()
+    data = r.json()
+    places_cache_put("textsearch", key, data)
+    return data, True
 
 
-def places_text_search_all(query: str, max_pages: int = 3):
-    results = []
+def wait_page_token(ready_at: float):
+    # O next_page_token só fica válido alguns segundos depois da resposta.
+    delay = ready_at - time.monotonic()
+    if delay > 0:
+        METRICS.add_time("textsearch_page_token_wait", delay)
+        time.sleep(delay)
+
+
+def places_text_search_fresh_token(query: str, page_idx: int):
+    """Refaz ao vivo as páginas anteriores a `page_idx` para obter um next_page_token
+    válido (o guardado no cache expira em pouco tempo)."""
+    METRICS.incr("textsearch_token_refresh")
     token = None
-    for page_idx in range(max_pages):
-        data = places_text_search_page(query, pagetoken=token)
-        results.extend(data.get("results", []))
+    ready_at = 0.0
+    for idx in range(page_idx):
+        if token:
+            wait_page_token(ready_at)
+        data, _ = places_text_search_page(query, idx, token, refresh=True)
         token = data.get("next_page_token")
+        ready_at = time.monotonic() + 2.2
         if not token:
-            break
-        if page_idx < max_pages - 1:
-            time.sleep(2.2)
-    return results
+            return None, ready_at
+    return token, ready_at
+
+
+def places_text_search_pages(query: str, max_pages: int = 3):
+    """Gera os resultados do text search página a página; a próxima página só é
+    buscada se quem consome o gerador pedir por ela."""
+    token = None
+    live = False  # o token atual veio de uma chamada ao vivo
+    ready_at = 0.0
+    for page_idx in range(max_pages):
+        if page_idx:
+            cached = PLACES_CACHE_OFFLINE or places_cache_has("textsearch", places_cache_key(query, page_idx))
+            if not cached:
+                if not live:
+                    token, ready_at = places_text_search_fresh_token(query, page_idx)
+                    if not token:
+                        return
+                wait_page_token(ready_at)
+        data, live = places_text_search_page(query, page_idx, token)
+        token = data.get("next_page_token")
+        # A espera pelo token corre enquanto os candidatos da página atual são avaliados.
+        ready_at = time.monotonic() + 2.2
+        yield data.get("results", [])
+        if not token or page_idx >= max_pages - 1:
+            return
+
+
+PLACES_FIND_FIELDS = "place_id,name,formatted_address,business_status,website,formatted_phone_number,international_phone_number"
+PLACES_DETAILS_FIELDS = (
+    "name,website,formatted_phone_number,international_phone_number,"
+    "formatted_address,business_status"
+)
 
 
 def places_find_place(query: str):
-    url = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
+    key = places_cache_key(query, PLACES_FIND_FIELDS)
+    cached = places_cache_get("findplace", key)
+    if cached is not None:
+        METRICS.incr("places_cache_hit_findplace")
+        return cached
+    METRICS.incr("places_cache_miss_findplace")
+    if PLACES_CACHE_OFFLINE:
+        return {"status": "CACHE_MISS", "candidates": []}
+
+    url = f"{PLACES_API_BASE}/findplacefromtext/json"
     params = {
         "input": query,
         "inputtype": "textquery",
-        "fields": "place_id,name,formatted_address,business_status,website,formatted_phone_number,international_phone_number",
+        "fields": PLACES_FIND_FIELDS,
         "key": API_KEY,
     }
-    r = SESSION.get(url, params=params, timeout=30)
+    rate_limit("findplace")
+    r = timed_get("findplace", url, params=params, timeout=30)
     r.raise_for_status()
-    return r.json()
+    data = r.json()
+    places_cache_put("findplace", key, data)
+    return data
 
 
 def places_details(place_id: str):
-    url = "https://maps.googleapis.com/maps/api/place/details/json"
-    fields = (
-        "name,website,formatted_phone_number,international_phone_number,"
-        "formatted_address,business_status"
-    )
-    r = SESSION.get(url, params={"place_id": place_id, "fields": fields, "key": API_KEY}, timeout=30)
+    fields = PLACES_DETAILS_FIELDS
+    key = places_cache_key(place_id, fields)
+    cached = places_cache_get("details", key)
+    if cached is not None:
+        METRICS.incr("places_cache_hit_details")
+        return cached
+    METRICS.incr("places_cache_miss_details")
+    if PLACES_CACHE_OFFLINE:
+        return {"status": "CACHE_MISS", "result": {}}
+
+    url = f"{PLACES_API_BASE}/details/json"
+    rate_limit("details")
+    r = timed_get("details", url, params={"place_id": place_id, "fields": fields, "key": API_KEY}, timeout=30)
     r.raise_for_status()
-    return r.json()
+    data = r.json()
+    places_cache_put("details", key, data)
+    return data
 
 
 def score_candidate(target_name: str, domain: str, det: dict) -> float:
@@ -157,28 +678,53 @@ def score_candidate(target_name: str, domain: str, det: dict) -> float:
     return score
 
 
+def rank_search_candidates(target_name: str, domain: str, results, seen_pids=(), top_k: int = DETAILS_TOP_K):
+    """Pré-ranqueia os resultados do text search só com o que já veio no payload
+    (nome, endereço, status) e devolve os top-K que ainda não tiveram details buscado."""
+    ranked = []
+    for idx, cand in enumerate(results):
+        pid = cand.get("place_id")
+        if not pid or pid in seen_pids:
+            continue
+        ranked.append((score_candidate(target_name, domain, cand), idx, cand))
+    ranked.sort(key=lambda t: (-t[0], t[1]))
+    return [cand for _, _, cand in ranked[:top_k]]
+
+
+def order_query_templates():
+    """QUERY_TEMPLATES pela taxa de acerto suavizada ((acertos + 1) / (tentativas + 2)); empates e
+    modelos sem histórico mantêm a ordem padrão, os podados vão para o fim."""
+    if not ADAPTIVE_QUERIES:
+        return list(QUERY_TEMPLATES)
+    stats = query_template_stats()
+
+    def pruned(template):
+        tries, wins = stats.get(template, (0, 0))
+        return tries >= QUERY_PRUNE_MIN_TRIES and wins == 0
+
+    def rate(template):
+        tries, wins = stats.get(template, (0, 0))
+        return (wins + 1) / (tries + 2)
+
+    active = sorted((t for t in QUERY_TEMPLATES if not pruned(t)), key=rate, reverse=True)
+    return active + [t for t in QUERY_TEMPLATES if pruned(t)]
+
+
 def build_queries(nome: str, domain: str):
+    """[(modelo, consulta)] na ordem em que devem ser tentadas, sem consultas repetidas."""
     nome = (nome or "").strip()
     alt = canonical_name(nome)
 
-    queries = []
-    if domain:
-        queries.append(f"{nome} {domain} Brasil")
-        queries.append(f"{alt} {domain} Brasil")
-    queries.append(f"{nome} embalagens Brasil")
-    queries.append(f"{alt} embalagens Brasil")
-    queries.append(f"{nome} papelão ondulado Brasil")
-    queries.append(f"{alt} Brasil")
-    queries.append(f"{nome} Brasil")
-
-    uniq = []
+    plan = []
     seen = set()
-    for q in queries:
-        q = q.strip()
+    for template in order_query_templates():
+        if "{domain}" in template and not domain:
+            continue
+        q = template.format(nome=nome, alt=alt, domain=domain).strip()
         if q and q not in seen:
             seen.add(q)
-            uniq.append(q)
-    return uniq
+            plan.append((template, q))
+    return plan
 
 
 def copy_via_powershell(src, dst):
@@ -191,21 +737,41 @@ def copy_via_powershell(src, dst):
     subprocess.run(cmd, check=True, capture_output=True, text=True)
 
 
-def load_workbook_with_lock_fallback(path):
+def read_bytes_with_lock_fallback(path) -> bytes:
     try:
-        wb = openpyxl.load_workbook(path)
-        wb_values = openpyxl.load_workbook(path, data_only=True)
-        return wb, wb_values, None
+        with open(path, "rb") as f:
+            return f.read()
     except PermissionError:
         temp_copy = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
         temp_copy.close()
         try:
-            shutil.copy2(path, temp_copy.name)
-        except PermissionError:
-            copy_via_powershell(path, temp_copy.name)
-        wb = openpyxl.load_workbook(temp_copy.name)
-        wb_values = openpyxl.load_workbook(temp_copy.name, data_only=True)
-        return wb, wb_values, temp_copy.name
+            try:
+                shutil.copy2(path, temp_copy.name)
+            except PermissionError:
+                copy_via_powershell(path, temp_copy.name)
+            with open(temp_copy.name, "rb") as f:
+                return f.read()
+        finally:
+            try:
+                os.remove(temp_copy.name)
+            except OSError:
+                pass
+
+
+def load_workbook_with_lock_fallback(path):
+    """Lê o arquivo do disco uma única vez e abre as duas visões a partir dos mesmos bytes.
+
+    A visão de valores é read-only: cada aba só é lida (em streaming) quando iterada.
+    """
+    data = read_bytes_with_lock_fallback(path)
+    wb = openpyxl.load_workbook(io.BytesIO(data))
+    wb_values = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    return wb, wb_values
+
+
+def load_workbook_read_only(path):
+    """Só a visão read-only (streaming) da planilha, para o modo --delta."""
+    return openpyxl.load_workbook(io.BytesIO(read_bytes_with_lock_fallback(path)), read_only=True)
 
 
 def save_workbook_with_fallback(wb, path):
@@ -219,26 +785,247 @@ def save_workbook_with_fallback(wb, path):
         return alt
 
 
-def fetch_html(url: str) -> str:
-    r = SESSION.get(url, timeout=25, allow_redirects=True)
-    r.raise_for_status()
-    r.encoding = r.apparent_encoding or "utf-8"
-    return r.text
+_SITE_CACHE_DB = None
+_SITE_CACHE_LOCK = threading.RLock()
+_DEAD_HOSTS = {}  # host -> bool, já consultado nesta execução
+
+
+def site_cache_db():
+    global _SITE_CACHE_DB
+    with _SITE_CACHE_LOCK:
+        if _SITE_CACHE_DB is None and SITE_CACHE_PATH:
+            db = sqlite3.connect(SITE_CACHE_PATH, check_same_thread=False, timeout=60)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS site_negative ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (kind, key))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS site_pages ("
+                "url TEXT PRIMARY KEY, body BLOB NOT NULL, content_type TEXT NOT NULL, "
+                "etag TEXT, last_modified TEXT, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS ix_site_pages_lru ON site_pages (accessed_at)")
+            now = time.time()
+            db.execute("DELETE FROM site_negative WHERE kind = 'host' AND created_at < ?", (now - SITE_DEAD_HOST_TTL,))
+            db.execute("DELETE FROM site_negative WHERE kind = 'url' AND created_at < ?", (now - SITE_MISSING_URL_TTL,))
+            db.commit()
+            _SITE_CACHE_DB = db
+        return _SITE_CACHE_DB
+
+
+def close_site_cache():
+    global _SITE_CACHE_DB
+    with _SITE_CACHE_LOCK:
+        if _SITE_CACHE_DB is not None:
+            _SITE_CACHE_DB.close()
+            _SITE_CACHE_DB = None
+
+
+def site_negative_has(kind: str, key: str) -> bool:
+    with _SITE_CACHE_LOCK:
+        db = site_cache_db()
+        if db is None:
+            return False
+        row = db.execute("SELECT 1 FROM site_negative WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        return row is not None
+
+
+def site_negative_put(kind: str, key: str):
+    with _SITE_CACHE_LOCK:
+        db = site_cache_db()
+        if db is None:
+            return
+        db.execute(
+            "INSERT OR REPLACE INTO site_negative (kind, key, created_at) VALUES (?, ?, ?)",
+            (kind, key, time.time()),
+        )
+        db.commit()
+
+
+def site_page_get(url: str):
+    """Página guardada para revalidação: (body, content_type, etag, last_modified) ou None."""
+    with _SITE_CACHE_LOCK:
+        db = site_cache_db()
+        if db is None or SITE_PAGE_CACHE_MAX_BYTES <= 0:
+            return None
+        return db.execute(
+            "SELECT body, content_type, etag, last_modified FROM site_pages WHERE url = ?", (url,)
+        ).fetchone()
+
+
+def site_page_touch(url: str):
+    with _SITE_CACHE_LOCK:
+        db = site_cache_db()
+        if db is None:
+            return
+        db.execute("UPDATE site_pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+        db.commit()
+
+
+def site_page_put(url: str, body: bytes, content_type: str, etag: str, last_modified: str):
+    with _SITE_CACHE_LOCK:
+        db = site_cache_db()
+        if db is None or SITE_PAGE_CACHE_MAX_BYTES <= 0 or len(body) > SITE_PAGE_CACHE_MAX_BYTES:
+            return
+        db.execute(
+            "INSERT OR REPLACE INTO site_pages (url, body, content_type, etag, last_modified, size, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, body, content_type, etag, last_modified, len(body), time.time()),
+        )
+        # LRU: descarta as páginas menos usadas até caber no limite.
+        db.execute(
+            "DELETE FROM site_pages WHERE url IN ("
+            "SELECT url FROM (SELECT url, SUM(size) OVER (ORDER BY accessed_at DESC, url) AS running FROM site_pages) "
+            "WHERE running > ?)",
+            (SITE_PAGE_CACHE_MAX_BYTES,),
+        )
+        db.commit()
+
+
+def site_host_is_dead(host: str) -> bool:
+    # Host compartilhado (facebook.com, wixsite.com...) nunca é dado como fora do ar: uma
+    # falha ali bloquearia o site de todas as empresas da plataforma.
+    if is_shared_host(host):
+        return False
+    with _SITE_CACHE_LOCK:
+        if host not in _DEAD_HOSTS:
+            _DEAD_HOSTS[host] = site_negative_has("host", host)
+        return _DEAD_HOSTS[host]
+
+
+def mark_site_host_dead(host: str):
+    if is_shared_host(host):
+        return
+    with _SITE_CACHE_LOCK:
+        _DEAD_HOSTS[host] = True
+        site_negative_put("host", host)
+
+
+def site_url_is_missing(url: str) -> bool:
+    return site_negative_has("url", url)
+
+
+def fetch_html(url: str, cancel=None) -> str:
+    """Baixa a página; `cancel` (threading.Event) interrompe a espera e o download."""
+    host = urlparse(url).netloc.lower()
+    with host_slot(url):
+        if cancel is not None and cancel.is_set():
+            raise ValueError(f"Download cancelado: {url}")
+        # Depois da primeira falha de conexão/DNS/timeout, o resto das URLs do host nem sai.
+        if site_host_is_dead(host):
+            METRICS.incr("site_dead_host_skip")
+            raise requests.ConnectionError(f"Host marcado como fora do ar: {host}")
+        # GET condicional: se a página não mudou, o servidor responde 304 sem corpo.
+        cached = site_page_get(url)
+        headers = {}
+        if cached:
+            if cached[2]:
+                headers["If-None-Match"] = cached[2]
+            if cached[3]:
+                headers["If-Modified-Since"] = cached[3]
+        rate_limit("site")
+        if cancel is not None and cancel.is_set():
+            raise ValueError(f"Download cancelado: {url}")
+        started = time.monotonic()
+        try:
+            r = timed_get("site", url, timeout=25, allow_redirects=True, stream=True, headers=headers)
+        except (requests.ConnectionError, requests.Timeout):
+            mark_site_host_dead(host)
+            raise
+        with r:
+            if r.status_code == 304 and cached:
+                METRICS.incr("site_page_cache_not_modified")
+                site_page_touch(url)
+                return decode_html(cached[0], cached[1])
+            if r.status_code in (404, 410):
+                site_negative_put("url", url)
+            r.raise_for_status()
+            content_type = r.headers.get("Content-Type", "")
+            media_type = content_type.split(";")[0].strip().lower()
+            if media_type and media_type not in HTML_CONTENT_TYPES:
+                raise ValueError(f"Conteúdo não-HTML em {url}: {media_type}")
+            body, complete = read_body_limited(r, SITE_MAX_BYTES, started + SITE_FETCH_DEADLINE, cancel)
+            METRICS.incr("site_bytes", len(body))
+            etag = r.headers.get("ETag")
+            last_modified = r.headers.get("Last-Modified")
+    # Um corpo cortado pelo prazo ou pelo tamanho não vai para o cache: com o ETag guardado,
+    # o 304 das próximas execuções reaproveitaria a página incompleta.
+    if complete and (etag or last_modified):
+        site_page_put(url, body, content_type, etag, last_modified)
+    return decode_html(body, content_type)
+
+
+def read_body_limited(r, max_bytes: int, deadline: float, cancel=None):
+    """Lê o corpo em streaming até max_bytes (o resto é descartado) ou até o prazo e devolve
+    (corpo, completo). Se `cancel` for acionado no meio, a leitura para com erro."""
+    chunks = []
+    size = 0
+    for chunk in r.iter_content(chunk_size=16 * 1024):
+        if cancel is not None and cancel.is_set():
+            METRICS.incr("site_fetch_cancelled")
+            raise ValueError("Download cancelado")
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes or time.monotonic() > deadline:
+            METRICS.incr("site_body_truncated")
+            return b"".join(chunks)[:max_bytes], False
+    return b"".join(chunks), True
+
+
+def decode_html(body: bytes, content_type: str = "") -> str:
+    """Charset do cabeçalho, depois da <meta> no início da página e, por último,
+    UTF-8 válido ou detecção, ambos só sobre um prefixo do corpo."""
+    m = CHARSET_RE.search(content_type or "")
+    encoding = m.group(1) if m else None
+    if not encoding:
+        m = META_CHARSET_RE.search(body[:SITE_SNIFF_BYTES])
+        encoding = m.group(1).decode("ascii") if m else None
+    if not encoding:
+        try:
+            codecs.getincrementaldecoder("utf-8")().decode(body[:SITE_SNIFF_BYTES], final=False)
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            encoding = chardet.detect(body[:SITE_SNIFF_BYTES]).get("encoding")
+    try:
+        return body.decode(encoding or "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
 
 
-def make_soup(html: str):
+def make_soup(html: str, parse_only=None):
     try:
-        return BeautifulSoup(html, "lxml")
+        return BeautifulSoup(html, "lxml", parse_only=parse_only)
     except FeatureNotFound:
-        return BeautifulSoup(html, "html.parser")
+        return BeautifulSoup(html, "html.parser", parse_only=parse_only)
+
+
+def html_to_text(html: str) -> str:
+    """Equivalente leve de soup.get_text("\n", strip=True): remove script/style/comentários e as tags."""
+    text = TAG_RE.sub("\n", NON_TEXT_RE.sub("\n", html or ""))
+    lines = (unescape(line).strip() for line in text.split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def extract_contact_fast(html: str):
+    """Telefone e endereço tirados do HTML cru (JSON-LD por regex + texto sem tags)."""
+    phones_ld, addrs_ld = extract_from_jsonld_blocks(m.group(2) for m in JSONLD_BLOCK_RE.finditer(html or ""))
+    phones_tx, addrs_tx = extract_phones_and_address_from_text(html_to_text(html))
+    return best_phone(phones_ld + phones_tx), best_address(addrs_ld + addrs_tx)
 
 
 def extract_from_jsonld(soup):
+    return extract_from_jsonld_blocks(
+        sc.string or "" for sc in soup.find_all("script", attrs={"type": "application/ld+json"})
+    )
+
+
+def extract_from_jsonld_blocks(blocks):
     phones = set()
     addresses = set()
 
-    for sc in soup.find_all("script", attrs={"type": "application/ld+json"}):
-        raw = (sc.string or "").strip()
+    for raw in blocks:
+        raw = (raw or "").strip()
         if not raw:
             continue
         try:
@@ -334,10 +1121,12 @@ def crawl_contact_pages(base_url: str, max_pages: int = 12):
         "/onde-estamos",
         "/localizacao",
     ]
-    candidates = [urljoin(base_url, p) for p in common]
+    # Caminhos fixos que já deram 404/410 neste host não são tentados de novo.
+    candidates = [u for u in (urljoin(base_url, p) for p in common) if not site_url_is_missing(u)]
+    METRICS.incr("site_missing_url_skip", len(common) - len(candidates))
 
     try:
-        soup = make_soup(fetch_html(base_url))
+        soup = make_soup(fetch_html(base_url), parse_only=SoupStrainer("a"))
         for a in soup.select("a[href]"):
             href = (a.get("href") or "").strip()
             txt = (a.get_text(" ", strip=True) or "").lower()
@@ -363,6 +1152,32 @@ def crawl_contact_pages(base_url: str, max_pages: int = 12):
     return uniq
 
 
+def scrape_page_for_contact(url: str, cancel=None):
+    try:
+        html = fetch_html(url, cancel)
+    except Exception:
+        return "", ""
+
+    p, a = extract_contact_fast(html)
+    if p or a:
+        METRICS.incr("site_extract_fast")
+        return p, a
+    METRICS.incr("site_extract_full_parse")
+
+    # Só monta a árvore quando o caminho rápido não achou nada, e só com <a> e <script>: o
+    # texto da página já passou pelas regex; aqui entram o JSON-LD que a regex não reconheceu
+    # e os links "tel:", cujo número não aparece no texto.
+    soup = make_soup(html, parse_only=SoupStrainer(["a", "script"]))
+    phones_ld, addrs_ld = extract_from_jsonld(soup)
+    phones_tel = []
+    for link in soup.find_all("a", href=True):
+        href = link["href"].strip()
+        if href.lower().startswith("tel:"):
+            phones_tel.extend(PHONE_RE.findall(unquote(href[4:])))
+
+    return best_phone(phones_ld + phones_tel), best_address(addrs_ld)
+
+
 def scrape_site_for_contact(site_url: str):
     site_url = normalize_url(site_url)
     if not site_url:
@@ -372,22 +1187,41 @@ def scrape_site_for_contact(site_url: str):
     if site_url not in pages:
         pages.append(site_url)
 
+    # As páginas são baixadas em paralelo, no máximo SITE_HOST_CONCURRENCY por vez;
+    # quando uma traz telefone e endereço, as posteriores deixam de ser pedidas e as que já
+    # estão na fila ou baixando são canceladas. O resultado é o mesmo da leitura sequencial:
+    # vence a primeira página, na ordem, com os dois.
+    cancel = threading.Event()
+    futures = []
+    winner = len(pages)
+    while True:
+        for idx, fut in enumerate(futures[:winner]):
+            if fut.done() and all(fut.result()):
+                winner = idx
+                break
+
+        in_flight = sum(1 for fut in futures if not fut.done())
+        while len(futures) < winner and in_flight < SITE_HOST_CONCURRENCY:
+            futures.append(SITE_POOL.submit(scrape_page_for_contact, pages[len(futures)], cancel))
+            in_flight += 1
+
+        needed = [fut for fut in futures[:winner] if not fut.done()]
+        if needed:
+            wait(needed, return_when=FIRST_COMPLETED)
+        elif len(futures) >= winner:
+            break
+
+    if futures[winner + 1:]:
+        cancel.set()
+        for fut in futures[winner + 1:]:
+            fut.cancel()
+
     best_p = ""
     best_a = ""
     best_src = ""
 
-    for url in pages:
-        try:
-            soup = make_soup(fetch_html(url))
-        except Exception:
-            continue
-
-        phones_ld, addrs_ld = extract_from_jsonld(soup)
-        text = soup.get_text("\n", strip=True)
-        phones_tx, addrs_tx = extract_phones_and_address_from_text(text)
-
-        p = best_phone(phones_ld + phones_tx)
-        a = best_address(addrs_ld + addrs_tx)
+    for url, fut in zip(pages, futures[:winner + 1]):
+        p, a = fut.result()
 
         score = int(bool(p)) + int(bool(a))
         if score == 2:
@@ -400,8 +1234,6 @@ def scrape_site_for_contact(site_url: str):
             best_a = a
             best_src = url
 
-        time.sleep(0.15)
-
     return best_p, best_a, best_src
 
 
@@ -445,13 +1277,16 @@ def parse_number(value):
         return 0.0
 
 
+def row_value(values, col):
+    return values[col - 1] if col and col <= len(values) else None
+
+
 def detect_curva_year_columns(ws_curva):
     year_row = None
     year_cols = []
-    for r in range(1, min(ws_curva.max_row, 20) + 1):
+    for r, values in enumerate(ws_curva.iter_rows(min_row=1, max_row=20, values_only=True), start=1):
         cols = []
-        for c in range(1, ws_curva.max_column + 1):
-            v = ws_curva.cell(r, c).value
+        for c, v in enumerate(values, start=1):
             try:
                 y = int(str(v).strip())
             except (TypeError, ValueError):
@@ -474,14 +1309,13 @@ def tokens_name(name):
     return set(parts)
 
 
-def build_curva_last_purchase_map(ws_curva):
-    _, year_cols = detect_curva_year_columns(ws_curva)
-    if not year_cols:
-        return {}
-
-    last_purchase = {}
-    for r in range(1, ws_curva.max_row + 1):
-        raw_name = ws_curva.cell(r, 1).value
+def read_curva_amounts(ws_curva, year_cols):
+    """Lê a CURVA ABC em streaming e devolve (chaves, valores): uma chave por linha com
+    nome e os valores das colunas de ano numa matriz achatada (array 'd', linha a linha)."""
+    keys = []
+    amounts = array("d")
+    for values in ws_curva.iter_rows(values_only=True):
+        raw_name = row_value(values, 1)
         if not raw_name:
             continue
 
@@ -489,12 +1323,42 @@ def build_curva_last_purchase_map(ws_curva):
         if not key:
             continue
 
-        latest_year = None
-        for c, y in year_cols:
-            amount = parse_number(ws_curva.cell(r, c).value)
-            if amount > 0:
-                latest_year = y
+        keys.append(key)
+        for c, _ in year_cols:
+            v = values[c - 1] if c <= len(values) else None
+            amounts.append(float(v) if type(v) in (int, float) else parse_number(v))
+    return keys, amounts
 
+
+def latest_positive_years(amounts, years):
+    """Para cada linha da matriz, o ano da última coluna com valor > 0 (0 se nenhuma)."""
+    n = len(years)
+    if np is not None:
+        mat = np.frombuffer(amounts, dtype=np.float64).reshape(-1, n)
+        positive = mat > 0
+        last = n - 1 - positive[:, ::-1].argmax(axis=1)
+        return np.where(positive.any(axis=1), np.asarray(years)[last], 0).tolist()
+
+    latest = []
+    for i in range(0, len(amounts), n):
+        year = 0
+        for j in range(n):
+            if amounts[i + j] > 0:
+                year = years[j]
+        latest.append(year)
+    return latest
+
+
+def build_curva_last_purchase_map(ws_curva):
+    _, year_cols = detect_curva_year_columns(ws_curva)
+    if not year_cols:
+        return {}
+
+    keys, amounts = read_curva_amounts(ws_curva, year_cols)
+    latest_years = latest_positive_years(amounts, [y for _, y in year_cols])
+
+    last_purchase = {}
+    for key, latest_year in zip(keys, latest_years):
         if latest_year:
             prev = last_purchase.get(key)
             if prev is None or latest_year > prev:
@@ -511,23 +1375,67 @@ def similarity_by_tokens(name_a, name_b):
     return len(a & b) / len(a | b)
 
 
-def find_best_last_purchase_year(candidate_names, curva_map):
+class NameIndex:
+    """Índice invertido token -> nomes para a busca fuzzy de `similarity_by_tokens`.
+
+    Cada nome é tokenizado uma única vez; na consulta só os nomes que dividem ao
+    menos um token são pontuados, com o mesmo Jaccard e o mesmo desempate
+    (primeiro nome inserido) da comparação par a par.
+    """
+
+    def __init__(self, names=()):
+        self.names = []
+        self.token_counts = []
+        self.postings = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        idx = len(self.names)
+        toks = tokens_name(name)
+        self.names.append(name)
+        self.token_counts.append(len(toks))
+        for t in toks:
+            self.postings.setdefault(t, []).append(idx)
+
+    def best_match(self, name, threshold: float):
+        """Devolve (score, nome) do nome mais parecido com score >= threshold, ou None."""
+        query = tokens_name(name)
+        if not query:
+            return None
+        overlap = {}
+        for t in query:
+            for idx in self.postings.get(t, ()):
+                overlap[idx] = overlap.get(idx, 0) + 1
+
+        best = None
+        for idx in sorted(overlap):
+            inter = overlap[idx]
+            score = inter / (len(query) + self.token_counts[idx] - inter)
+            if score >= threshold and (best is None or score > best[0]):
+                best = (score, idx)
+        if best is None:
+            return None
+        return best[0], self.names[best[1]]
+
+
+def find_best_last_purchase_year(candidate_names, curva_map, curva_index=None):
     for n in candidate_names:
         key = normalize_company_name(n)
         if key in curva_map:
             return curva_map[key]
 
-    best_year = None
-    best_score = 0.0
+    if curva_index is None:
+        curva_index = NameIndex(curva_map)
+
+    best = None
     for n in candidate_names:
-        for curva_name, year in curva_map.items():
-            score = similarity_by_tokens(n, curva_name)
-            if score > best_score:
-                best_score = score
-                best_year = year
-
-    if best_score >= 0.72:
-        return best_year
+        match = curva_index.best_match(n, 0.72)
+        if match and (best is None or match[0] > best[0]):
+            best = match
+
+    if best:
+        return curva_map[best[1]]
     return None
 
 
@@ -551,17 +1459,19 @@ def fill_base_representantes_last_purchase(wb, wb_values=None):
     curva_map = build_curva_last_purchase_map(ws_curva)
     if not curva_map:
         return 0
+    curva_index = NameIndex(curva_map)
 
     updated = 0
-    for r in range(2, ws_base.max_row + 1):
-        razao = ws_base_values.cell(r, col_razao).value
-        fantasia = ws_base_values.cell(r, col_fantasia).value if col_fantasia else None
+    base_rows = ws_base_values.iter_rows(min_row=2, max_row=ws_base.max_row, values_only=True)
+    for r, values in enumerate(base_rows, start=2):
+        razao = row_value(values, col_razao)
+        fantasia = row_value(values, col_fantasia)
 
         names = [razao]
         if fantasia:
             names.append(fantasia)
 
-        year = find_best_last_purchase_year(names, curva_map)
+        year = find_best_last_purchase_year(names, curva_map, curva_index)
         if year:
             ws_base.cell(r, col_ultima).value = str(year)
             updated += 1
@@ -580,13 +1490,9 @@ def build_base_client_name_set(wb, wb_values=None):
     col_fantasia = base_headers.get("nome fantasia")
 
     names = set()
-    for r in range(2, ws_base.max_row + 1):
-        if col_razao:
-            v = ws_base_values.cell(r, col_razao).value
-            if v:
-                names.add(normalize_company_name(v))
-        if col_fantasia:
-            v = ws_base_values.cell(r, col_fantasia).value
+    for values in ws_base_values.iter_rows(min_row=2, max_row=ws_base.max_row, values_only=True):
+        for col in (col_razao, col_fantasia):
+            v = row_value(values, col)
             if v:
                 names.add(normalize_company_name(v))
     names.discard("")
@@ -605,6 +1511,22 @@ def ensure_removed_headers(ws_removed):
     return current
 
 
+def delete_rows_bulk(ws, rows):
+    """Remove várias linhas de uma vez: cada bloco de linhas mantidas sobe uma única
+    vez (com valores e formatação), em vez de um delete_rows por linha."""
+    rows = sorted(set(rows))
+    if not rows:
+        return
+    max_row = ws.max_row
+    last_col = get_column_letter(ws.max_column)
+    bounds = rows + [max_row + 1]
+    for shift, (removed, next_removed) in enumerate(zip(bounds, bounds[1:]), start=1):
+        first, last = removed + 1, next_removed - 1
+        if first <= last:
+            ws.move_range(f"A{first}:{last_col}{last}", rows=-shift)
+    ws.delete_rows(max_row - len(rows) + 1, len(rows))
+
+
 def remove_existing_clients_from_clientes(wb, wb_values=None):
     if "Clientes" not in wb.sheetnames or "Removidos" not in wb.sheetnames:
         return 0
@@ -614,198 +1536,1089 @@ def remove_existing_clients_from_clientes(wb, wb_values=None):
 
     client_headers = build_header_map(ws_clientes)
 
-    col_tipo = client_headers.get("tipo da fabrica")
     col_nome = client_headers.get("nome")
-    col_site = client_headers.get("site")
-    col_tel = client_headers.get("telefone")
-    col_end = client_headers.get("endereco")
     if not col_nome:
         return 0
 
-    removed_headers = ensure_removed_headers(ws_removed)
     base_names = build_base_client_name_set(wb, wb_values=wb_values)
+    base_index = NameIndex(base_names)
 
-    to_remove = []
-    for r in range(2, ws_clientes.max_row + 1):
-        nome = ws_clientes.cell(r, col_nome).value
+    to_remove = []  # (linha, valores)
+    for r, values in enumerate(ws_clientes.iter_rows(min_row=2, values_only=True), start=2):
+        nome = row_value(values, col_nome)
         if not nome:
             continue
         key = normalize_company_name(nome)
         if key in base_names:
-            to_remove.append(r)
+            to_remove.append((r, values))
             continue
 
         # Fuzzy fallback para nomes parecidos.
-        match = False
-        for base_name in base_names:
-            if similarity_by_tokens(nome, base_name) >= 0.78:
-                match = True
-                break
-        if match:
-            to_remove.append(r)
-
-    for r in reversed(to_remove):
-        new_row = ws_removed.max_row + 1
-        ws_removed.cell(new_row, removed_headers["tipo da fabrica"]).value = ws_clientes.cell(r, col_tipo).value if col_tipo else None
-        ws_removed.cell(new_row, removed_headers["nome"]).value = ws_clientes.cell(r, col_nome).value
-        ws_removed.cell(new_row, removed_headers["site"]).value = ws_clientes.cell(r, col_site).value if col_site else None
-        ws_removed.cell(new_row, removed_headers["telefone"]).value = ws_clientes.cell(r, col_tel).value if col_tel else None
-        ws_removed.cell(new_row, removed_headers["endereco"]).value = ws_clientes.cell(r, col_end).value if col_end else None
-        ws_removed.cell(new_row, removed_headers["motivo"]).value = "Já existe na BASE REPRESENTANTES (CRM)"
-        ws_clientes.delete_rows(r, 1)
+        if base_index.best_match(nome, 0.78):
+            to_remove.append((r, values))
 
+    # Mesma ordem de antes (de baixo para cima), gravada num único lote.
+    motivo = "Já existe na BASE REPRESENTANTES (CRM)"
+    append_removed_rows(ws_removed, client_headers, [(values, motivo) for _, values in reversed(to_remove)])
+
+    delete_rows_bulk(ws_clientes, [r for r, _ in to_remove])
     return len(to_remove)
 
 
-has_api = has_api_key()
-wb, wb_values, temp_path = load_workbook_with_lock_fallback(ARQ_IN)
-ws = wb[SHEET]
+def append_removed_rows(ws_removed, client_headers, entries):
+    """Anexa na aba Removidos as linhas (valores da aba Clientes, motivo) de `entries`."""
+    removed_headers = ensure_removed_headers(ws_removed)
+    first_row = ws_removed.max_row + 1
+    for offset, (values, motivo) in enumerate(entries):
+        new_row = first_row + offset
+        for key in ("tipo da fabrica", "nome", "site", "telefone", "endereco"):
+            ws_removed.cell(new_row, removed_headers[key]).value = row_value(values, client_headers.get(key))
+        ws_removed.cell(new_row, removed_headers["motivo"]).value = motivo
+
+
+# Permutações da MinHash: (a * h + b) mod primo sobre o crc32 de cada token; sementes fixas
+# para que os grupos sejam os mesmos a cada execução.
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_RNG = random.Random(20240611)
+_MINHASH_PARAMS = [
+    (_MINHASH_RNG.randrange(1, _MINHASH_PRIME), _MINHASH_RNG.randrange(0, _MINHASH_PRIME))
+    for _ in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
+
+def minhash_signature(tokens, cache: dict):
+    """Assinatura MinHash de um conjunto de tokens; `cache` guarda as permutações de cada token
+    (o vocabulário de nomes é bem menor que o total de tokens)."""
+    vectors = []
+    for t in tokens:
+        v = cache.get(t)
+        if v is None:
+            h = zlib.crc32(t.encode("utf-8"))
+            v = cache[t] = tuple((a * h + b) % _MINHASH_PRIME for a, b in _MINHASH_PARAMS)
+        vectors.append(v)
+    return tuple(map(min, zip(*vectors)))
+
+
+class UnionFind:
+    """Conjuntos disjuntos sobre 0..n-1; a raiz de cada grupo é sempre o seu menor índice.
+    Com `labels` (ex.: o domínio de cada item), dois grupos com rótulos diferentes, ambos
+    preenchidos, nunca são unidos, nem através de um terceiro item sem rótulo."""
+
+    def __init__(self, n: int, labels=None):
+        self.parent = list(range(n))
+        self.label = list(labels) if labels is not None else [""] * n  # válido na raiz
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> bool:
+        """Une os grupos de i e j; devolve False se os rótulos impedirem."""
+        ri, rj = self.find(i), self.find(j)
+        if ri == rj:
+            return True
+        li, lj = self.label[ri], self.label[rj]
+        if li and lj and li != lj:
+            return False
+        root = min(ri, rj)
+        self.parent[max(ri, rj)] = root
+        self.label[root] = li or lj
+        return True
+
+    def groups(self, indices):
+        """Grupos dos `indices`, cada um em ordem crescente, na ordem do primeiro item."""
+        groups = {}
+        for i in indices:
+            groups.setdefault(self.find(i), []).append(i)
+        return list(groups.values())
+
+
+def near_duplicate_clusters(token_sets, threshold: float, domains=None):
+    """Agrupa os índices de `token_sets` com Jaccard >= threshold em tempo quase linear: só os
+    pares que caem no mesmo balde de alguma banda da MinHash são comparados (exatamente).
+    Grupos com domínios diferentes (ambos preenchidos) nunca são ligados, nem através de um
+    terceiro item sem site. Devolve os grupos com 2+ itens, cada um em ordem crescente, na
+    ordem do primeiro item."""
+    n = len(token_sets)
+    domains = domains or [""] * n
+    uf = UnionFind(n, domains)
+
+    # Conjuntos idênticos (com o mesmo domínio) se ligam direto; a LSH só vê um de cada.
+    first_of = {}
+    reps = []
+    for i, toks in enumerate(token_sets):
+        if not toks:
+            continue
+        key = (frozenset(toks), domains[i])
+        if key in first_of:
+            uf.union(i, first_of[key])
+        else:
+            first_of[key] = i
+            reps.append(i)
+
+    # Baldes por (banda, trecho da assinatura, tamanho do conjunto): Jaccard >= threshold exige
+    # menor/maior >= threshold nos tamanhos, então só tamanhos compatíveis são comparados.
+    buckets = {}
+    cache = {}
+    for i in reps:
+        sig = minhash_signature(token_sets[i], cache)
+        for band in range(MINHASH_BANDS):
+            key = (band, sig[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS])
+            buckets.setdefault(key, {}).setdefault(len(token_sets[i]), []).append(i)
+
+    compared = set()
+    for by_size in buckets.values():
+        sizes = sorted(by_size)
+        for x, size_a in enumerate(sizes):
+            for size_b in sizes[x:]:
+                if size_a < threshold * size_b:
+                    break
+                group_a, group_b = by_size[size_a], by_size[size_b]
+                for y, i in enumerate(group_a):
+                    for j in group_a[y + 1:] if size_a == size_b else group_b:
+                        pair = (i, j) if i < j else (j, i)
+                        if pair in compared:
+                            continue
+                        compared.add(pair)
+                        if domains[i] and domains[j] and domains[i] != domains[j]:
+                            continue
+                        if uf.find(i) == uf.find(j):
+                            continue
+                        a, b = token_sets[i], token_sets[j]
+                        inter = len(a & b)
+                        if inter / (len(a) + len(b) - inter) >= threshold:
+                            uf.union(i, j)
+
+    return [g for g in uf.groups(i for i in range(n) if token_sets[i]) if len(g) > 1]
+
+
+def remove_near_duplicate_clientes(wb):
+    """Etapa dedupe-clientes: move para Removidos as linhas da aba Clientes quase iguais a outra
+    (ex.: "Embalagens XYZ Ltda" e "XYZ Embalagens"). De cada grupo fica a linha mais preenchida
+    (Site, Telefone, Endereço; a primeira em caso de empate). Devolve os grupos encontrados como
+    [{"kept": {"row", "nome"}, "removed": [{"row", "nome"}, ...]}], com as linhas de antes da remoção."""
+    if "Clientes" not in wb.sheetnames or "Removidos" not in wb.sheetnames:
+        return []
 
-updated_last_purchase = fill_base_representantes_last_purchase(wb, wb_values=wb_values)
-removed_existing = remove_existing_clients_from_clientes(wb, wb_values=wb_values)
+    ws_clientes = wb["Clientes"]
+    client_headers = build_header_map(ws_clientes)
+    col_nome = client_headers.get("nome")
+    col_site = client_headers.get("site")
+    if not col_nome:
+        return []
 
-headers = {}
-for col in range(1, ws.max_column + 1):
-    v = ws.cell(HEADER_ROW, col).value
-    if v:
-        headers[normalize_header(v)] = col
+    rows = [
+        (r, values)
+        for r, values in enumerate(ws_clientes.iter_rows(min_row=2, values_only=True), start=2)
+        if row_value(values, col_nome)
+    ]
+    token_sets = [tokens_name(row_value(values, col_nome)) for _, values in rows]
+    clusters = near_duplicate_clusters(
+        token_sets,
+        CLIENTES_DUP_THRESHOLD,
+        domains=[site_key(str(row_value(values, col_site) or "")) for _, values in rows],
+    )
 
-col_nome = headers.get("nome")
-col_site = headers.get("site")
-col_tel = headers.get("telefone")
-col_end = headers.get("endereco")
+    filled_cols = [client_headers.get(k) for k in ("site", "telefone", "endereco")]
+    exposed = []
+    to_remove = []  # (linha, valores, motivo)
+    for members in clusters:
+        keep = max(members, key=lambda i: (sum(1 for c in filled_cols if row_value(rows[i][1], c)), -i))
+        kept_nome = str(row_value(rows[keep][1], col_nome))
+        removed = [i for i in members if i != keep]
+        exposed.append({
+            "kept": {"row": rows[keep][0], "nome": kept_nome},
+            "removed": [{"row": rows[i][0], "nome": str(row_value(rows[i][1], col_nome))} for i in removed],
+        })
+        for i in removed:
+            kind = "Duplicado" if token_sets[i] == token_sets[keep] else "Quase duplicado"
+            to_remove.append((rows[i][0], rows[i][1], f"{kind} de \"{kept_nome}\" na aba Clientes"))
+
+    to_remove.sort(key=lambda item: item[0])
+    append_removed_rows(wb["Removidos"], client_headers, [(values, motivo) for _, values, motivo in to_remove])
+    delete_rows_bulk(ws_clientes, [r for r, _, _ in to_remove])
+    return exposed
+
+
+_COMPANY_STORE_DB = None
+_COMPANY_STORE_LOCK = threading.RLock()
+COMPANY_FIELDS = ("telefone", "endereco", "placeid", "score", "fonte", "status")
+
+
+def company_store_db():
+    global _COMPANY_STORE_DB
+    with _COMPANY_STORE_LOCK:
+        if _COMPANY_STORE_DB is None and COMPANY_STORE_PATH:
+            db = sqlite3.connect(COMPANY_STORE_PATH, check_same_thread=False, timeout=60)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS companies ("
+                "name_key TEXT PRIMARY KEY, domain TEXT NOT NULL, place_id TEXT NOT NULL, "
+                "telefone TEXT NOT NULL, endereco TEXT NOT NULL, score REAL, fonte TEXT NOT NULL, "
+                "status TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS ix_companies_domain ON companies (domain, updated_at)")
+            db.execute("CREATE INDEX IF NOT EXISTS ix_companies_place_id ON companies (place_id)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS query_templates ("
+                "template TEXT PRIMARY KEY, tries INTEGER NOT NULL, wins INTEGER NOT NULL)"
+            )
+            db.execute("DELETE FROM companies WHERE updated_at < ?", (time.time() - COMPANY_STORE_TTL,))
+            # Bases antigas indexavam também hosts compartilhados (facebook.com...), que
+            # ligariam empresas diferentes na busca por domínio.
+            shared = [d for (d,) in db.execute("SELECT DISTINCT domain FROM companies") if is_shared_host(d)]
+            db.executemany("UPDATE companies SET domain = '' WHERE domain = ?", [(d,) for d in shared])
+            db.commit()
+            _COMPANY_STORE_DB = db
+        return _COMPANY_STORE_DB
+
+
+def company_store_get(nome: str, domain: str):
+    """Contato conhecido da empresa, pelo nome normalizado ou, se não houver, pelo domínio
+    próprio (hosts compartilhados não identificam a empresa e são ignorados)."""
+    name_key = normalize_company_name(nome)
+    if is_shared_host(domain):
+        domain = ""
+    with _COMPANY_STORE_LOCK:
+        db = company_store_db()
+        if db is None:
+            return None
+        since = time.time() - COMPANY_STORE_TTL
+        cols = "telefone, endereco, place_id, score, fonte, status"
+        row = None
+        if name_key:
+            row = db.execute(
+                f"SELECT {cols} FROM companies WHERE name_key = ? AND updated_at >= ?", (name_key, since)
+            ).fetchone()
+        if row is None and domain:
+            row = db.execute(
+                f"SELECT {cols} FROM companies WHERE domain = ? AND updated_at >= ? ORDER BY updated_at DESC LIMIT 1",
+                (domain, since),
+            ).fetchone()
+    return dict(zip(COMPANY_FIELDS, row)) if row else None
+
+
+def company_store_put(nome: str, domain: str, contact: dict):
+    """Grava o contato resolvido para o nome consultado. Outros nomes já ligados ao mesmo
+    place_id recebem o telefone/endereço novos (o score e a fonte são de cada nome)."""
+    name_key = normalize_company_name(nome)
+    if not name_key:
+        return
+    values = (
+        "" if is_shared_host(domain) else domain or "",
+        contact.get("placeid") or "",
+        contact["telefone"],
+        contact["endereco"],
+        contact.get("score"),
+        contact.get("fonte") or "",
+        contact["status"],
+        time.time(),
+    )
+    with _COMPANY_STORE_LOCK:
+        db = company_store_db()
+        if db is None:
+            return
+        db.execute(
+            "INSERT OR REPLACE INTO companies "
+            "(name_key, domain, place_id, telefone, endereco, score, fonte, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name_key, *values),
+        )
+        if values[1]:
+            db.execute(
+                "UPDATE companies SET telefone = ?, endereco = ?, updated_at = ? WHERE place_id = ?",
+                (values[2], values[3], values[7], values[1]),
+            )
+        db.commit()
+
+
+_QUERY_STATS = None  # {modelo: (tentativas, acertos)}, lido uma vez por execução
+
+
+def query_template_stats():
+    """Histórico dos modelos de consulta como estava no início da execução: as linhas desta
+    execução não mudam a ordem das próximas (o resultado não depende do paralelismo)."""
+    global _QUERY_STATS
+    with _COMPANY_STORE_LOCK:
+        if _QUERY_STATS is None:
+            db = company_store_db()
+            rows = db.execute("SELECT template, tries, wins FROM query_templates") if db is not None else ()
+            _QUERY_STATS = {template: (tries, wins) for template, tries, wins in rows}
+        return _QUERY_STATS
+
+
+def record_query_templates(tried, winner):
+    """Soma uma tentativa a cada modelo usado e um acerto ao que achou a empresa (se algum)."""
+    with _COMPANY_STORE_LOCK:
+        db = company_store_db()
+        if db is None or not tried:
+            return
+        for template in tried:
+            db.execute(
+                "INSERT INTO query_templates (template, tries, wins) VALUES (?, 1, ?) "
+                "ON CONFLICT (template) DO UPDATE SET tries = tries + 1, wins = wins + excluded.wins",
+                (template, int(template == winner)),
+            )
+        db.commit()
+
+
+def close_company_store():
+    global _COMPANY_STORE_DB
+    with _COMPANY_STORE_LOCK:
+        if _COMPANY_STORE_DB is not None:
+            _COMPANY_STORE_DB.close()
+            _COMPANY_STORE_DB = None
+
+
+def resolve_places(nome: str, domain: str):
+    best = None  # (score, det, pid, fonte)
+    detailed = set()  # place_ids já detalhados (as consultas se sobrepõem muito)
+    tried = []  # modelos cuja busca de fato rodou, para o histórico de acertos
+    winner = None
+
+    for template, q in build_queries(nome, domain):
+        remaining = 40
+        try:
+            for page_idx, results in enumerate(places_text_search_pages(q, max_pages=3)):
+                if page_idx == 0:
+                    tried.append(template)
+                results = results[:remaining]
+                remaining -= len(results)
+
+                for cand in rank_search_candidates(nome, domain, results, detailed):
+                    pid = cand["place_id"]
+                    detailed.add(pid)
+                    try:
+                        det = places_details(pid).get("result", {})
+                    except requests.HTTPError:
+                        continue
+
+                    score = score_candidate(nome, domain, det)
+                    item = (score, det, pid, "Google Places TextSearch")
+                    if best is None or item[0] > best[0]:
+                        best = item
+                    if best[0] >= ACCEPT_SCORE:
+                        break
+
+                # Próximas páginas só se nada desta já foi aceito.
+                if (best and best[0] >= ACCEPT_SCORE) or remaining <= 0:
+                    break
+        except requests.HTTPError:
+            continue
+
+        if best and best[0] >= ACCEPT_SCORE:
+            winner = template
+            break
 
-col_status = ensure_col(ws, headers, "Status")
-col_placeid = ensure_col(ws, headers, "PlaceId")
-col_score = ensure_col(ws, headers, "Score")
-col_src = ensure_col(ws, headers, "Fonte")
+    # Offline, uma falta no cache não diz nada sobre o modelo; não entra nas taxas de acerto.
+    if not PLACES_CACHE_OFFLINE:
+        record_query_templates(tried, winner)
 
-if not col_nome or not col_tel or not col_end:
-    raise ValueError("Não achei cabeçalhos 'Nome', 'Telefone' e 'Endereço' na aba Clientes.")
+    if not best:
+        try:
+            fp = places_find_place(f"{nome} Brasil")
+        except requests.HTTPError:
+            fp = {}
 
-processed = 0
-for row in range(HEADER_ROW + 1, ws.max_row + 1):
-    nome = ws.cell(row, col_nome).value
-    if not nome:
-        continue
+        for cand in fp.get("candidates", [])[:TOP_N]:
+            pid = cand.get("place_id")
+            if not pid:
+                continue
+            score = score_candidate(nome, domain, cand)
+            item = (score, cand, pid, "Google Places FindPlace")
+            if best is None or item[0] > best[0]:
+                best = item
+
+    return best
+
+
+def plan_row_groups(items):
+    """Agrupa as linhas que são a mesma empresa (mesmo normalize_company_name ou mesmo
+    site_key). Linhas com site_keys diferentes nunca caem no mesmo grupo, mesmo com o
+    nome igual. `items` é uma lista de (nome, site); devolve listas de índices, cada
+    uma em ordem crescente e na ordem da primeira linha de cada grupo."""
+    sites = [site_key(str(site) if site else "") for _, site in items]
+    uf = UnionFind(len(items), sites)
+    owner = {}
+    for i, (nome, _) in enumerate(items):
+        keys = (("nome", normalize_company_name(nome)), ("site", sites[i]))
+        for key in keys:
+            if not key[1]:
+                continue
+            uf.union(i, owner.setdefault(key, i))
+    return uf.groups(range(len(items)))
 
-    if MAX_ROWS > 0 and processed >= MAX_ROWS:
-        break
 
-    tel = ws.cell(row, col_tel).value
-    end = ws.cell(row, col_end).value
-    site = ws.cell(row, col_site).value if col_site else ""
-    domain = get_domain(str(site) if site else "")
+def enrich_group(members, has_api: bool, use_site: bool = True):
+    """Resolve uma empresa uma única vez e devolve, para cada linha de `members`
+    [(nome, site, tel, end)], o {coluna: valor} a gravar, sem tocar na planilha.
+    Com `use_site=False` (só a etapa enrich-places) o site não é consultado."""
+    nome = members[0][0]
+    domain = next((d for d in (company_domain(str(m[1]) if m[1] else "") for m in members) if d), "")
 
-    if tel and end:
-        ws.cell(row, col_status).value = "OK (já preenchido)"
-        continue
+    known = company_store_get(nome, domain)
+    if known is not None:
+        METRICS.incr("company_store_hit")
+        return [contact_from_store(known, tel, end) for _, _, tel, end in members]
+    METRICS.incr("company_store_miss")
 
-    best = None  # (score, det, pid, fonte)
+    best = resolve_places(nome, domain) if has_api else None
+    scraped = {}  # URL normalizada -> resultado do scraper, uma vez por site
 
-    if has_api:
-        for q in build_queries(str(nome), domain):
+    results = []
+    for _, site, tel, end in members:
+        out = {}
+        if best:
+            score, det, pid, fonte = best
+            phone = det.get("international_phone_number") or det.get("formatted_phone_number") or ""
+            addr = det.get("formatted_address") or ""
+
+            if (not tel) and phone:
+                tel = out["telefone"] = phone
+            if (not end) and addr:
+                end = out["endereco"] = addr
+
+            out["placeid"] = pid
+            out["score"] = round(score, 2)
+            out["fonte"] = fonte
+
+        if tel and end:
+            out["status"] = "OK (Places)" if has_api else "OK (Site)"
+            results.append(out)
+            continue
+
+        if not use_site:
+            out["status"] = "PARCIAL (Places)" if tel or end else "NAO_ENCONTRADO (Places)"
+            results.append(out)
+            continue
+
+        site_url = str(site).strip() if site else ""
+        page_key = normalize_url(site_url).lower().rstrip("/")
+        if page_key not in scraped:
+            scraped[page_key] = scrape_site_for_contact(site_url)
+        sp, sa, src_url = scraped[page_key]
+
+        if (not tel) and sp:
+            tel = out["telefone"] = sp
+        if (not end) and sa:
+            end = out["endereco"] = sa
+
+        if tel and end:
+            out["status"] = "OK (Site)"
+        elif tel or end:
+            out["status"] = "PARCIAL (Site)"
+        else:
+            out["status"] = "NAO_ENCONTRADO (Places+Site)" if has_api else "NAO_ENCONTRADO (Site)"
+        out["fonte"] = src_url or site_url
+        results.append(out)
+
+    # Só um contato completo encontrado aqui (telefone e endereço) vai para a base local,
+    # sob o nome que de fato foi resolvido: o consultado no Places ou o da linha cujo
+    # site trouxe o contato. Falhas e parciais são tentadas de novo na próxima planilha.
+    for (member_nome, member_site, _, _), out in zip(members, results):
+        if out["status"].startswith("OK") and "telefone" in out and "endereco" in out:
+            if out.get("placeid"):
+                company_store_put(nome, domain, out)
+            else:
+                company_store_put(member_nome, company_domain(str(member_site) if member_site else ""), out)
+            break
+    return results
+
+
+def contact_from_store(known: dict, tel, end) -> dict:
+    """Resultado de uma linha a partir de um contato da base local, como enrich_group o daria."""
+    out = {}
+    if not tel:
+        out["telefone"] = known["telefone"]
+    if not end:
+        out["endereco"] = known["endereco"]
+    if known["placeid"]:
+        out["placeid"] = known["placeid"]
+    if known["score"] is not None:
+        out["score"] = known["score"]
+    out["fonte"] = known["fonte"]
+    out["status"] = known["status"]
+    return out
+
+
+class CheckpointJournal:
+    """Journal append-only (JSONL) com o resultado de cada linha assim que ele fica pronto."""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a" if resume else "w", encoding="utf-8") if path else None
+        if self.file is not None and self.file.tell() > 0:
+            # Fecha uma possível linha truncada antes de continuar anexando.
+            self.file.write("\n")
+
+    def record(self, row: int, nome: str, result: dict):
+        if self.file is None:
+            return
+        line = json.dumps({"row": row, "nome": nome, "result": result}, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self, remove=False):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def row_fingerprint(nome, site, tel, end) -> str:
+    raw = json.dumps([str(v or "").strip() for v in (nome, site, tel, end)], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class RunHistory:
+    """Resultado mais recente de cada linha, indexado pela impressão digital das entradas
+    (Nome, Site, Telefone, Endereço), para reexecuções incrementais. Cada resultado guarda
+    se o Places foi consultado: um resultado só do site não vale para uma execução com API."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path) if path else None
+        if self.db is not None:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS row_history ("
+                "fingerprint TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "places INTEGER NOT NULL DEFAULT 0)"
+            )
+            cols = {row[1] for row in self.db.execute("PRAGMA table_info(row_history)")}
+            if "places" not in cols:
+                # Históricos antigos não registravam o modo; valem como execuções sem Places.
+                self.db.execute("ALTER TABLE row_history ADD COLUMN places INTEGER NOT NULL DEFAULT 0")
+
+    def fresh_result(self, fingerprint: str, places: bool):
+        """Resultado ainda válido: OK dentro de HISTORY_OK_TTL, falhas dentro de HISTORY_RETRY_AFTER,
+        produzido com Places se esta execução também usa o Places."""
+        if self.db is None:
+            return None
+        row = self.db.execute(
+            "SELECT status, result, updated_at, places FROM row_history WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        if not row:
+            return None
+        status, result, updated_at, used_places = row
+        if places and not used_places:
+            return None
+        max_age = HISTORY_OK_TTL if status.startswith("OK") else HISTORY_RETRY_AFTER
+        if time.time() - updated_at > max_age:
+            return None
+        return json.loads(result)
+
+    def record(self, fingerprint: str, result: dict, places: bool):
+        if self.db is None:
+            return
+        self.db.execute(
+            "INSERT OR REPLACE INTO row_history (fingerprint, status, result, updated_at, places) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (fingerprint, result.get("status", ""), json.dumps(result, ensure_ascii=False), time.time(), int(places)),
+        )
+
+    def close(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+
+def load_checkpoint(path):
+    """Lê o journal de uma execução interrompida: {linha: (nome, resultado)}.
+    Uma última linha truncada (processo morto no meio da gravação) é ignorada."""
+    done = {}
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
             try:
-                results = places_text_search_all(q, max_pages=3)
-            except requests.HTTPError as e:
-                ws.cell(row, col_status).value = f"ERRO textsearch: {e}"
+                entry = json.loads(line)
+            except ValueError:
                 continue
-
-            for cand in results[:40]:
-                pid = cand.get("place_id")
-                if not pid:
-                    continue
-                try:
-                    det = places_details(pid).get("result", {})
-                except requests.HTTPError:
+            done[entry["row"]] = (entry["nome"], entry["result"])
+    return done
+
+
+class ClienteRow:
+    """Linha da aba Clientes lida uma única vez: entradas do enriquecimento e as
+    células a regravar no fim ({chave de result_cols: valor})."""
+
+    __slots__ = ("row", "nome", "site", "tel", "end", "changes")
+
+    def __init__(self, row: int, nome: str, site, tel, end):
+        self.row = row
+        self.nome = nome
+        self.site = site
+        self.tel = tel
+        self.end = end
+        self.changes = None
+
+    @property
+    def inputs(self):
+        """(nome, site, tel, end), o formato de enrich_group e row_fingerprint."""
+        return (self.nome, self.site, self.tel, self.end)
+
+    def update(self, values: dict):
+        if self.changes is None:
+            self.changes = {}
+        self.changes.update(values)
+
+
+def read_clientes_rows(ws, col_nome, col_site, col_tel, col_end):
+    """Lê a aba Clientes numa só passada de iter_rows; devolve um ClienteRow por linha com Nome."""
+    max_col = max(c for c in (col_nome, col_site, col_tel, col_end) if c)
+    rows = []
+    for row, values in enumerate(
+        ws.iter_rows(min_row=HEADER_ROW + 1, max_col=max_col, values_only=True), start=HEADER_ROW + 1
+    ):
+        nome = row_value(values, col_nome)
+        if not nome:
+            continue
+        site = row_value(values, col_site) if col_site else ""
+        rows.append(ClienteRow(row, str(nome), site, row_value(values, col_tel), row_value(values, col_end)))
+    return rows
+
+
+def write_clientes_rows(ws, rows, result_cols):
+    """Grava de uma vez, no fim, as células alteradas de cada ClienteRow."""
+    for rec in rows:
+        if rec.changes:
+            for key, value in rec.changes.items():
+                ws.cell(rec.row, result_cols[key]).value = value
+
+
+# Colunas que o enriquecimento grava na aba Clientes (chave do resultado -> título).
+RESULT_TITLES = {
+    "telefone": "Telefone",
+    "endereco": "Endereço",
+    "status": "Status",
+    "placeid": "PlaceId",
+    "score": "Score",
+    "fonte": "Fonte",
+}
+
+
+def write_delta_csv(path, rows):
+    """Grava as alterações dos ClienteRow num CSV (linha, Nome e uma coluna por resultado);
+    célula vazia = sem alteração. ";" e BOM para abrir direto no Excel em português."""
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["linha", "Nome", *RESULT_TITLES.values()])
+        for rec in rows:
+            if rec.changes:
+                writer.writerow([rec.row, rec.nome, *(rec.changes.get(key, "") for key in RESULT_TITLES)])
+
+
+def apply_delta_csv(ws, path):
+    """Aplica na aba Clientes um delta de write_delta_csv. Linhas cujo Nome não bate mais
+    (a planilha mudou desde o delta) são ignoradas. Devolve (aplicadas, ignoradas)."""
+    headers = read_header_map(ws)
+    col_nome = headers.get("nome")
+    if not col_nome:
+        raise ValueError("Não achei o cabeçalho 'Nome' na aba Clientes.")
+    result_cols = {key: ensure_col(ws, headers, title) for key, title in RESULT_TITLES.items()}
+
+    applied = skipped = 0
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f, delimiter=";")
+        next(reader, None)
+        for line in reader:
+            row, nome, values = int(line[0]), line[1], line[2:]
+            if str(ws.cell(row, col_nome).value or "") != nome:
+                skipped += 1
+                continue
+            for key, value in zip(RESULT_TITLES, values):
+                if value == "":
                     continue
+                ws.cell(row, result_cols[key]).value = float(value) if key == "score" else value
+            applied += 1
+    return applied, skipped
 
-                score = score_candidate(str(nome), domain, det)
-                item = (score, det, pid, "Google Places TextSearch")
-                if best is None or item[0] > best[0]:
-                    best = item
 
-            if best and best[0] >= 6.0:
-                break
+def enrich_group_checkpointed(journal, items, has_api: bool, use_site: bool = True):
+    """`items` são os ClienteRow de uma mesma empresa."""
+    results = enrich_group([rec.inputs for rec in items], has_api, use_site)
+    for rec, result in zip(items, results):
+        journal.record(rec.row, rec.nome, result)
+    return results
 
-            time.sleep(SLEEP)
 
-        if not best:
-            try:
-                fp = places_find_place(f"{nome} Brasil")
-            except requests.HTTPError:
-                fp = {}
+def shard_init(processes: int, query_stats: dict):
+    """Inicializa um processo de enriquecimento: sessão HTTP própria, 1/N de cada limite de taxa
+    e o mesmo histórico de modelos de consulta que o processo pai leu."""
+    global _QUERY_STATS
+    _QUERY_STATS = query_stats
+    load_http_stack()
+    for kind, rate in RATE_LIMITS.items():
+        RATE_LIMITERS[kind] = TokenBucket(rate / processes)
+
+
+def enrich_shard(tasks, has_api: bool, use_site: bool):
+    """Roda num processo filho. `tasks` é [(grupo, [(nome, site, tel, end), ...])]; devolve
+    ([(grupo, [resultado por linha])], métricas do processo desde a última remessa)."""
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        futures = [(g, pool.submit(enrich_group, members, has_api, use_site)) for g, members in tasks]
+        done = [(g, f.result()) for g, f in futures]
+    return done, METRICS.drain()
+
+
+def submit_sharded(pool, journal, to_run, groups, has_api: bool, use_site: bool):
+    """Distribui os grupos em remessas pelos processos de `pool`; devolve uma função que
+    espera e entrega os resultados de um grupo (mesmo formato de enrich_group)."""
+    chunk = WORKERS * 2  # grupos por remessa: mantém as threads de cada processo ocupadas
+    shard_of = {}  # grupo -> future da remessa
+    for start in range(0, len(groups), chunk):
+        tasks = [(g, [to_run[idx].inputs for idx in groups[g]]) for g in range(start, min(start + chunk, len(groups)))]
+        future = pool.submit(enrich_shard, tasks, has_api, use_site)
+        future.add_done_callback(lambda f: journal_shard(f, journal, to_run, groups))
+        for g, _ in tasks:
+            shard_of[g] = future
+
+    results = {}
+
+    def result_of(g):
+        if g not in results:
+            results.update(shard_of[g].result()[0])
+        return results[g]
+
+    return result_of
+
+
+def journal_shard(future, journal, to_run, groups):
+    """Ao fim de cada remessa, grava no journal e soma as métricas do processo filho."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    done, metrics = future.result()
+    METRICS.merge(metrics)
+    for g, results in done:
+        for idx, result in zip(groups[g], results):
+            journal.record(to_run[idx].row, to_run[idx].nome, result)
+
+
+def read_header_map(ws):
+    """Cabeçalho normalizado -> coluna, lido com iter_rows (serve também para abas read-only)."""
+    headers = {}
+    for values in ws.iter_rows(min_row=HEADER_ROW, max_row=HEADER_ROW, values_only=True):
+        for col, v in enumerate(values, start=1):
+            if v:
+                headers[normalize_header(v)] = col
+    return headers
 
-            for cand in fp.get("candidates", [])[:TOP_N]:
-                pid = cand.get("place_id")
-                if not pid:
-                    continue
-                score = score_candidate(str(nome), domain, cand)
-                item = (score, cand, pid, "Google Places FindPlace")
-                if best is None or item[0] > best[0]:
-                    best = item
 
-    if best:
-        score, det, pid, fonte = best
-        phone = det.get("international_phone_number") or det.get("formatted_phone_number") or ""
-        addr = det.get("formatted_address") or ""
-
-        if (not tel) and phone:
-            ws.cell(row, col_tel).value = phone
-        if (not end) and addr:
-            ws.cell(row, col_end).value = addr
-
-        ws.cell(row, col_placeid).value = pid
-        ws.cell(row, col_score).value = round(score, 2)
-        ws.cell(row, col_src).value = fonte
-
-    tel2 = ws.cell(row, col_tel).value
-    end2 = ws.cell(row, col_end).value
-
-    if tel2 and end2:
-        ws.cell(row, col_status).value = "OK (Places)" if has_api else "OK (Site)"
-        processed += 1
-        time.sleep(SLEEP)
-        continue
-
-    site_url = str(site).strip() if site else ""
-    sp, sa, src_url = scrape_site_for_contact(site_url)
-
-    if (not tel2) and sp:
-        ws.cell(row, col_tel).value = sp
-    if (not end2) and sa:
-        ws.cell(row, col_end).value = sa
-
-    tel3 = ws.cell(row, col_tel).value
-    end3 = ws.cell(row, col_end).value
-
-    if tel3 and end3:
-        ws.cell(row, col_status).value = "OK (Site)"
-        ws.cell(row, col_src).value = src_url or site_url
-    elif tel3 or end3:
-        ws.cell(row, col_status).value = "PARCIAL (Site)"
-        ws.cell(row, col_src).value = src_url or site_url
+def read_clientes_records(ws, headers):
+    col_nome = headers.get("nome")
+    col_tel = headers.get("telefone")
+    col_end = headers.get("endereco")
+    if not col_nome or not col_tel or not col_end:
+        raise ValueError("Não achei cabeçalhos 'Nome', 'Telefone' e 'Endereço' na aba Clientes.")
+    return read_clientes_rows(ws, col_nome, headers.get("site"), col_tel, col_end)
+
+
+def enrich_clientes(ws, journal, has_api: bool, use_site: bool, resume: bool, incremental: bool, max_rows: int,
+                    processes: int = 1):
+    """Etapas enrich-places/enrich-site sobre a aba Clientes; devolve as contagens da execução."""
+    headers = read_header_map(ws)
+    records = read_clientes_records(ws, headers)
+    # Status, PlaceId, Score e Fonte são criadas no fim do cabeçalho se ainda não existirem.
+    result_cols = {key: ensure_col(ws, headers, title) for key, title in RESULT_TITLES.items()}
+    stats = enrich_records(records, journal, has_api, use_site, resume, incremental, max_rows, processes)
+    with METRICS.stage("write_back"):
+        write_clientes_rows(ws, records, result_cols)
+    return stats
+
+
+def enrich_clientes_delta(ws, delta_path, journal, has_api: bool, use_site: bool, resume: bool, incremental: bool,
+                          max_rows: int, processes: int = 1):
+    """Como enrich_clientes, mas sobre uma aba read-only: as alterações vão para o CSV `delta_path`."""
+    records = read_clientes_records(ws, read_header_map(ws))
+    stats = enrich_records(records, journal, has_api, use_site, resume, incremental, max_rows, processes)
+    with METRICS.stage("write_back"):
+        write_delta_csv(delta_path, records)
+    return stats
+
+
+def enrich_records(records, journal, has_api: bool, use_site: bool, resume: bool, incremental: bool, max_rows: int,
+                   processes: int = 1):
+    """Enriquece os ClienteRow em memória (sem tocar na planilha); devolve as contagens da execução.
+    Com `resume`, as linhas já gravadas no `journal` de uma execução interrompida são reaplicadas.
+    Com `processes` > 1 os grupos são resolvidos em processos filhos (spawn, como no Windows)."""
+    pending = []
+    for rec in records:
+        if max_rows > 0 and len(pending) >= max_rows:
+            break
+        if rec.tel and rec.end:
+            rec.update({"status": "OK (já preenchido)"})
+            continue
+        pending.append(rec)
+
+    checkpoint = load_checkpoint(journal.path) if resume else {}
+    resumed = 0
+    to_run = []
+    for rec in pending:
+        saved = checkpoint.get(rec.row)
+        # A linha só é reaproveitada se ainda for a mesma empresa (a planilha pode ter mudado).
+        if saved and saved[0] == rec.nome:
+            rec.update(saved[1])
+            resumed += 1
+        else:
+            to_run.append(rec)
+
+    # O histórico só guarda resultados do enriquecimento completo (Places + site com API, ou só
+    # site sem API); uma execução parcial não pode impedir a próxima de tentar a outra fonte, e
+    # um resultado obtido sem API não impede a próxima execução com API de consultar o Places.
+    # No modo PLACES_CACHE_OFFLINE nada é gravado: falta no cache não é falha real do Places.
+    history = RunHistory(HISTORY_PATH if use_site else "")
+    skipped_unchanged = 0
+    if incremental:
+        still_to_run = []
+        for rec in to_run:
+            previous = history.fresh_result(row_fingerprint(*rec.inputs), has_api)
+            if previous is not None:
+                rec.update(previous)
+                skipped_unchanged += 1
+            else:
+                still_to_run.append(rec)
+        to_run = still_to_run
+
+    # Linhas da mesma empresa (nome normalizado ou domínio) são resolvidas uma vez só.
+    groups = plan_row_groups([(rec.nome, rec.site) for rec in to_run])
+    slot_of = {}  # índice em to_run -> (grupo, posição no grupo)
+    for g, members in enumerate(groups):
+        for pos, idx in enumerate(members):
+            slot_of[idx] = (g, pos)
+
+    # Os grupos são resolvidos em paralelo; os resultados são recolhidos na ordem original.
+    progress = ProgressLine(len(to_run), enabled=PROGRESS)
+    status_counts = {}
+    if processes > 1 and groups:
+        pool = ProcessPoolExecutor(
+            max_workers=min(processes, len(groups)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=shard_init,
+            initargs=(processes, query_template_stats()),
+        )
     else:
-        ws.cell(row, col_status).value = "NAO_ENCONTRADO (Places+Site)" if has_api else "NAO_ENCONTRADO (Site)"
-        ws.cell(row, col_src).value = src_url or site_url
+        pool = ThreadPoolExecutor(max_workers=WORKERS)
+    try:
+        if isinstance(pool, ProcessPoolExecutor):
+            result_of = submit_sharded(pool, journal, to_run, groups, has_api, use_site)
+        else:
+            futures = [
+                pool.submit(enrich_group_checkpointed, journal, [to_run[idx] for idx in members], has_api, use_site)
+                for members in groups
+            ]
+
+            def result_of(g):
+                return futures[g].result()
+
+        for idx, rec in enumerate(to_run):
+            g, pos = slot_of[idx]
+            result = result_of(g)[pos]
+            rec.update(result)
+            if not PLACES_CACHE_OFFLINE:
+                history.record(row_fingerprint(*rec.inputs), result, has_api)
+            status = str(result.get("status") or "")
+            status_counts[status] = status_counts.get(status, 0) + 1
+            progress.update(idx + 1)
+    except BaseException:
+        # O que já terminou está no journal; o resto é descartado para o --resume.
+        progress.finish()
+        pool.shutdown(wait=True, cancel_futures=True)
+        history.close()
+        raise
+    progress.finish()
+    pool.shutdown()
+    history.close()
+
+    return {
+        "pending": len(pending),
+        "resumed": resumed,
+        "skipped_unchanged": skipped_unchanged,
+        "enriched": len(to_run),
+        "distinct_companies": len(groups),
+        "status": status_counts,
+    }
 
-    processed += 1
-    time.sleep(SLEEP)
 
-saved_out = save_workbook_with_fallback(wb, ARQ_OUT)
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(
+        description="Prospecção: atualiza a última compra na BASE, tira da aba Clientes quem já está no CRM "
+        "e preenche telefone/endereço pelo Google Places e pelos sites."
+    )
+    ap.add_argument(
+        "stages",
+        nargs="*",
+        metavar="ETAPA",
+        help="etapas a rodar, entre " + ", ".join(STAGES) + " (padrão: todas; com --delta, só as de enriquecimento; "
+        "com --apply-delta, nenhuma)",
+    )
+    ap.add_argument("-i", "--input", default=ARQ_IN, help="planilha de entrada")
+    ap.add_argument("-o", "--output", default=ARQ_OUT, help="planilha gerada")
+    ap.add_argument(
+        "--delta",
+        metavar="CSV",
+        help="não gera planilha: lê a entrada em streaming (read-only) e grava só as alterações do "
+        "enriquecimento neste CSV, para juntar depois com --apply-delta",
+    )
+    ap.add_argument("--apply-delta", metavar="CSV", help="aplica na aba Clientes um CSV gerado com --delta")
+    ap.add_argument("--max-rows", type=int, default=MAX_ROWS, help="máximo de linhas a enriquecer (0 = todas)")
+    ap.add_argument("--resume", action="store_true", help="reaplica o checkpoint e segue das linhas que faltam")
+    ap.add_argument("--incremental", action="store_true", help="pula linhas inalteradas com resultado recente")
+    ap.add_argument(
+        "--processes",
+        type=int,
+        default=PROCESSES,
+        help="processos de enriquecimento, cada um com WORKERS threads e 1/N dos limites de taxa (0 = um por núcleo)",
+    )
+    args = ap.parse_args(argv)
+
+    unknown = [st for st in args.stages if st not in STAGES]
+    if unknown:
+        ap.error(f"etapa desconhecida: {', '.join(unknown)} (use {', '.join(STAGES)})")
+    if args.delta and args.apply_delta:
+        ap.error("--delta e --apply-delta não podem ser usados juntos")
+    if args.stages:
+        args.stages = set(args.stages)
+    elif args.delta:
+        args.stages = {"enrich-places", "enrich-site"}
+    elif args.apply_delta:
+        args.stages = set()
+    else:
+        args.stages = set(STAGES)
+    if args.delta and args.stages - {"enrich-places", "enrich-site"}:
+        ap.error("--delta só vale para as etapas enrich-places e enrich-site")
+    if args.processes <= 0:
+        args.processes = os.cpu_count() or 1
+    if args.stages & {"enrich-places"} and not args.stages & {"enrich-site"} and not has_api_key():
+        ap.error("enrich-places precisa de GOOGLE_MAPS_API_KEY (ou PLACES_CACHE_OFFLINE=1)")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = args.stages
+    enrich = bool(stages & {"enrich-places", "enrich-site"})
+    has_api = "enrich-places" in stages and has_api_key()
+    use_site = "enrich-site" in stages
+    target = args.delta or args.output
+    checkpoint_path = CHECKPOINT_PATH if CHECKPOINT_PATH is not None else target + ".checkpoint.jsonl"
+    report_path = RUN_REPORT_PATH if RUN_REPORT_PATH is not None else target + ".report.json"
+    if enrich:
+        load_http_stack()
+
+    with METRICS.stage("load"):
+        if args.delta:
+            # Sem a planilha editável na memória: só a leitura em streaming e os ClienteRow.
+            wb, wb_values = None, load_workbook_read_only(args.input)
+        else:
+            wb, wb_values = load_workbook_with_lock_fallback(args.input)
+
+    delta_applied = None
+    if args.apply_delta:
+        with METRICS.stage("apply_delta"):
+            delta_applied = apply_delta_csv(wb[SHEET], args.apply_delta)
+
+    updated_last_purchase = removed_existing = None
+    if "last-purchase" in stages:
+        with METRICS.stage("last_purchase"):
+            updated_last_purchase = fill_base_representantes_last_purchase(wb, wb_values=wb_values)
+    if "dedupe-crm" in stages:
+        with METRICS.stage("dedupe_crm"):
+            removed_existing = remove_existing_clients_from_clientes(wb, wb_values=wb_values)
+    duplicate_clusters = None
+    if "dedupe-clientes" in stages:
+        with METRICS.stage("dedupe_clientes"):
+            duplicate_clusters = remove_near_duplicate_clientes(wb)
+
+    stats = None
+    journal = CheckpointJournal(checkpoint_path if enrich else "", resume=args.resume)
+    try:
+        if enrich and args.delta:
+            with METRICS.stage("enrich"):
+                stats = enrich_clientes_delta(
+                    wb_values[SHEET], args.delta, journal, has_api, use_site, args.resume, args.incremental,
+                    args.max_rows, processes=args.processes,
+                )
+        elif enrich:
+            with METRICS.stage("enrich"):
+                stats = enrich_clientes(
+                    wb[SHEET], journal, has_api, use_site, args.resume, args.incremental, args.max_rows,
+                    processes=args.processes,
+                )
+
+        if args.delta:
+            saved_out = args.delta
+        else:
+            with METRICS.stage("save"):
+                saved_out = save_workbook_with_fallback(wb, args.output)
+    except BaseException:
+        # O que já terminou está no journal para o --resume.
+        journal.close()
+        raise
+    journal.close(remove=True)
 
-if temp_path:
     try:
-        os.remove(temp_path)
-    except OSError:
+        wb_values.close()
+    except Exception:
         pass
 
-try:
-    wb_values.close()
-except Exception:
-    pass
-
-print("Gerado:", saved_out)
-print("Modo API:", "ATIVO" if has_api else "DESATIVADO")
-print("BASE Ultima compra atualizada:", updated_last_purchase)
-print("Clientes movidos para Removidos:", removed_existing)
+    close_places_cache()
+    close_site_cache()
+    close_company_store()
+    SITE_POOL.shutdown()
+
+    rows = {"last_purchase_updated": updated_last_purchase, "removed_existing": removed_existing}
+    if delta_applied is not None:
+        rows["delta_applied"], rows["delta_skipped"] = delta_applied
+    if duplicate_clusters is not None:
+        rows["near_duplicates_removed"] = sum(len(c["removed"]) for c in duplicate_clusters)
+    status_counts = {}
+    if stats:
+        status_counts = stats.pop("status")
+        rows.update(stats)
+    METRICS.write(report_path, {
+        "output": saved_out,
+        "stages": [st for st in STAGES if st in stages],
+        "api": has_api,
+        "rows": rows,
+        "status": status_counts,
+        "duplicate_clusters": duplicate_clusters or [],
+    })
+
+    print("Gerado:", saved_out)
+    if delta_applied is not None:
+        print("Delta aplicado:", delta_applied[0], "linhas;", delta_applied[1], "ignoradas (Nome diferente)")
+    if updated_last_purchase is not None:
+        print("BASE Ultima compra atualizada:", updated_last_purchase)
+    if removed_existing is not None:
+        print("Clientes movidos para Removidos:", removed_existing)
+    if duplicate_clusters is not None:
+        print(
+            "Duplicados da aba Clientes movidos para Removidos:",
+            sum(len(c["removed"]) for c in duplicate_clusters),
+            "em",
+            len(duplicate_clusters),
+            "grupos",
+        )
+    if stats:
+        print("Modo API:", "ATIVO" if has_api else "DESATIVADO")
+        print("Empresas distintas consultadas:", stats["distinct_companies"], "de", stats["enriched"], "linhas")
+        if args.resume:
+            print("Linhas retomadas do checkpoint:", stats["resumed"])
+        if args.incremental:
+            print("Linhas inalteradas puladas (histórico):", stats["skipped_unchanged"])
+    if report_path:
+        print("Relatório da execução:", report_path)
+
+
+if __name__ == "__main__":
+    main()